@@ -0,0 +1,44 @@
+"""
+Benchmarks CompletedIndex over photorec-like layouts to check that tracking completed files
+scales linearly with the number of files
+
+Run from the repository root with `python -m benchmarks.completed_tracking`
+"""
+import time
+
+from helpers.completed_index_helper import CompletedIndex
+
+FILES_PER_DIRECTORY = 500
+SCALES = (10_000, 100_000, 1_000_000)
+
+
+def run(file_count: int) -> float:
+    """
+    Checks, completes and prunes file_count files the way pre-processing does and returns the
+    elapsed time in seconds
+    """
+    index = CompletedIndex()
+    start = time.perf_counter()
+    for directory_number in range(file_count // FILES_PER_DIRECTORY):
+        directory = f"/recovery/recup_dir.{directory_number}"
+        index.is_directory_completed(directory)
+        for file_number in range(FILES_PER_DIRECTORY):
+            path = f"{directory}/f{directory_number * FILES_PER_DIRECTORY + file_number:07d}.jpg"
+            if not index.is_file_completed(path):
+                index.complete_file(path)
+        index.complete_directory(directory)
+    return time.perf_counter() - start
+
+
+def main():
+    """
+    Prints the time per file at every scale, which should stay roughly constant
+    """
+    for file_count in SCALES:
+        elapsed = run(file_count)
+        print(f"{file_count:>9} files: {elapsed:8.3f}s "
+              f"({elapsed / file_count * 1_000_000:.2f} us/file)")
+
+
+if __name__ == "__main__":
+    main()
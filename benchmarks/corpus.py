@@ -0,0 +1,251 @@
+"""
+Generates synthetic photorec recovery trees to benchmark against
+
+Files are spread over `recup_dir.#` directories and named `f#######.ext`, or `t#######.ext` for
+thumbnails, like photorec names them. The corpus mixes images, videos, text documents and other
+files, with exact duplicates, near duplicates and corrupt files among them. The same seed
+always generates the same corpus
+
+Run from the repository root with `python -m benchmarks.corpus ROOT --files 1000`
+"""
+import argparse
+import os
+import random
+import shutil
+import subprocess
+import sys
+import typing
+
+if typing.TYPE_CHECKING:
+    import PIL.Image
+
+FILES_PER_DIRECTORY = 500
+# Spread modify dates over a few years so that files are sorted into many date directories
+START_TIME = 1262304000  # 2010-01-01
+END_TIME = 1577836800  # 2020-01-01
+
+DEFAULT_MIX = {"images": 0.6, "videos": 0.05, "texts": 0.15, "others": 0.2}
+DEFAULT_RATES = {"exact": 0.1, "near": 0.1, "corrupt": 0.02, "thumbnails": 0.05}
+# Videos are slow to encode, so only this many distinct videos are encoded and copied
+UNIQUE_VIDEOS = 20
+
+WORDS = (
+    "about above account across action after again against agreement amount animal answer "
+    "appear apple around attempt balance basket because before behaviour believe between "
+    "bottle branch bread breakfast bridge brother building business button camera careful "
+    "chance change cheese church circle clothing cloud coffee colour comfort company control "
+    "country current danger daughter decision degree design detail dinner direction distance "
+    "document doctor driver early education effect engine evening example experience family "
+    "father feeling field finger flower follow forward friend garden government guide harbour "
+    "health history holiday hospital husband industry insurance island journey kitchen "
+    "knowledge language letter library machine market meeting memory minute morning mother "
+    "mountain number office orange paper parent pencil picture place pleasure pocket power "
+    "present question reason record report river science season second service shadow sister "
+    "station stomach street summer system teacher thought ticket train travel valley village "
+    "wash water weather window winter woman wonder yellow yesterday"
+).split()
+
+
+class CorpusGenerator:
+    """
+    Writes a synthetic recovery tree under root
+
+    mix - share of the files that are images, videos, texts and others
+    rates - share of the files that are exact duplicates, near duplicates, corrupt files and
+        thumbnails of earlier files
+    """
+    def __init__(self, root: str, seed: int = 0, mix: dict[str, float] | None = None,
+                 rates: dict[str, float] | None = None):
+        self.root = root
+        self.random = random.Random(seed)
+        self.mix = mix or DEFAULT_MIX
+        self.rates = rates or DEFAULT_RATES
+        self.number = 0
+        self.originals: dict[str, list] = {"images": [], "texts": [], "others": []}
+        self.videos: list[str] = []
+        self.counts: dict[str, int] = {}
+
+    def generate(self, file_count: int) -> dict[str, int]:
+        """
+        Writes file_count files and returns how many of every kind were written
+        """
+        kinds = list(self.mix)
+        weights = [self.mix[kind] for kind in kinds]
+        has_ffmpeg = shutil.which("ffmpeg") is not None
+        if not has_ffmpeg and "videos" in kinds:
+            print("ffmpeg is not installed, no videos are generated", file=sys.stderr)
+        for _ in range(file_count):
+            kind = self.random.choices(kinds, weights)[0]
+            if kind == "videos" and not has_ffmpeg:
+                kind = "others"
+            getattr(self, f"_write_{kind[:-1]}")()
+        return self.counts
+
+    def _next_path(self, extension: str, prefix: str = "f") -> str:
+        self.number += 1
+        directory = os.path.join(self.root,
+                                 f"recup_dir.{(self.number - 1) // FILES_PER_DIRECTORY + 1}")
+        os.makedirs(directory, exist_ok=True)
+        return os.path.join(directory, f"{prefix}{self.number:07d}.{extension}")
+
+    def _finish(self, path: str, kind: str) -> None:
+        modify_time = self.random.randint(START_TIME, END_TIME)
+        os.utime(path, (modify_time, modify_time))
+        self.counts[kind] = self.counts.get(kind, 0) + 1
+
+    def _pick_variant(self, kind: str) -> str:
+        """
+        Returns exact, near, corrupt, thumbnail or original for the next file of the kind
+        """
+        if not self.originals.get(kind):
+            return "original"
+        roll = self.random.random()
+        for variant in ("exact", "near", "corrupt", "thumbnails"):
+            roll -= self.rates.get(variant, 0)
+            if roll < 0:
+                return variant
+        return "original"
+
+    def _write_image(self) -> None:
+        import PIL.Image
+        import PIL.ImageEnhance
+
+        variant = self._pick_variant("images")
+        if variant == "thumbnails":
+            source, _ = self.random.choice(self.originals["images"])
+            path = self._next_path("jpg", prefix="t")
+            with PIL.Image.open(source) as image:
+                image.convert("RGB").resize((64, 64)).save(path, quality=80)
+            self._finish(path, "thumbnails")
+            return
+        if variant == "exact":
+            source, _ = self.random.choice(self.originals["images"])
+            path = self._next_path(source.rsplit(".", 1)[-1])
+            shutil.copyfile(source, path)
+            self._finish(path, "exact duplicates")
+            return
+        if variant == "corrupt":
+            source, _ = self.random.choice(self.originals["images"])
+            path = self._next_path(source.rsplit(".", 1)[-1])
+            with open(source, "rb") as f:
+                contents = f.read()
+            with open(path, "wb") as f:
+                f.write(contents[:max(len(contents) // 3, 16)])
+            self._finish(path, "corrupt")
+            return
+
+        if variant == "near":
+            _, seed = self.random.choice(self.originals["images"])
+        else:
+            seed = self.random.getrandbits(32)
+        image = self._make_image(seed)
+        if variant == "near":
+            # Brightness changes and re-encoding keep the perceptual hash within a few bits
+            image = PIL.ImageEnhance.Brightness(image).enhance(self.random.uniform(0.9, 1.1))
+        extension = self.random.choice(("jpg", "jpg", "jpg", "png"))
+        path = self._next_path(extension)
+        image.save(path, **({"quality": self.random.randint(75, 95)}
+                            if extension == "jpg" else {}))
+        if variant == "original":
+            self.originals["images"].append((path, seed))
+        self._finish(path, "near duplicates" if variant == "near" else "images")
+
+    @staticmethod
+    def _make_image(seed: int) -> "PIL.Image.Image":
+        """
+        Returns an image of coloured blocks that is the same for the same seed
+        """
+        import PIL.Image
+
+        block_random = random.Random(seed)
+        small = PIL.Image.new("RGB", (16, 12))
+        small.putdata([(block_random.randrange(256), block_random.randrange(256),
+                        block_random.randrange(256)) for _ in range(16 * 12)])
+        return small.resize((320, 240), PIL.Image.BILINEAR)
+
+    def _write_video(self) -> None:
+        if len(self.videos) < UNIQUE_VIDEOS:
+            path = self._next_path("mp4")
+            command = ["ffmpeg", "-nostdin", "-v", "error", "-f", "lavfi", "-i",
+                       "testsrc2=size=160x120:rate=10:duration=2",
+                       "-vf", f"hue=h={len(self.videos) * 360 // UNIQUE_VIDEOS}",
+                       "-c:v", "mpeg4", "-y", path]
+            subprocess.run(command, check=True)
+            self.videos.append(path)
+            self._finish(path, "videos")
+        else:
+            source = self.random.choice(self.videos)
+            path = self._next_path("mp4")
+            shutil.copyfile(source, path)
+            self._finish(path, "exact duplicates")
+
+    def _write_text(self) -> None:
+        variant = self._pick_variant("texts")
+        if variant == "thumbnails":
+            variant = "original"
+        if variant in ("exact", "near", "corrupt"):
+            words = list(self.random.choice(self.originals["texts"]))
+        else:
+            words = [self.random.choice(WORDS) for _ in range(self.random.randint(200, 2000))]
+        if variant == "near":
+            for _ in range(max(len(words) // 100, 1)):
+                words[self.random.randrange(len(words))] = self.random.choice(WORDS)
+
+        path = self._next_path("txt")
+        if variant == "corrupt":
+            # Not valid utf-8, so reading it fails
+            with open(path, "wb") as f:
+                f.write(b"\xff\xfe\xfa" + self.random.randbytes(512))
+        else:
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(" ".join(words))
+        if variant == "original":
+            self.originals["texts"].append(words)
+        self._finish(path, {"exact": "exact duplicates", "near": "near duplicates",
+                            "corrupt": "corrupt", "original": "texts"}[variant])
+
+    def _write_other(self) -> None:
+        variant = self._pick_variant("others")
+        path = self._next_path(self.random.choice(("bin", "zip", "mp3", "exe")))
+        if variant == "exact":
+            shutil.copyfile(self.random.choice(self.originals["others"]), path)
+        else:
+            with open(path, "wb") as f:
+                f.write(self.random.randbytes(self.random.randint(1024, 64 * 1024)))
+            self.originals["others"].append(path)
+        self._finish(path, "exact duplicates" if variant == "exact" else "others")
+
+
+def parse_shares(value: str) -> dict[str, float]:
+    """
+    Parses `images=0.6,texts=0.4` into a dictionary
+    """
+    shares = {}
+    for item in value.split(","):
+        name, share = item.split("=")
+        shares[name.strip()] = float(share)
+    return shares
+
+
+def main(argv: list[str]):
+    """
+    Generates a corpus from the command line
+    """
+    parser = argparse.ArgumentParser(description="Generates a synthetic photorec recovery tree")
+    parser.add_argument("root", help="directory the corpus is written to")
+    parser.add_argument("--files", type=int, default=1000, help="number of files to write")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--mix", type=parse_shares,
+                        help="share of every kind of file, e.g. images=0.6,videos=0.05,"
+                             "texts=0.15,others=0.2")
+    parser.add_argument("--rates", type=parse_shares,
+                        help="share of duplicates and damaged files, e.g. exact=0.1,near=0.1,"
+                             "corrupt=0.02,thumbnails=0.05")
+    args = parser.parse_args(argv)
+    counts = CorpusGenerator(args.root, args.seed, args.mix, args.rates).generate(args.files)
+    for kind, count in sorted(counts.items()):
+        print(f"{kind}: {count}")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
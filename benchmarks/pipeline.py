@@ -0,0 +1,188 @@
+"""
+Benchmarks pre_process, prepare_folders and sort over synthetic photorec corpora
+
+Every scale runs in its own process, so that its peak RSS is its own and the class level file
+dictionaries of DupeCleaner start empty. The corpus is generated in yet another process, so
+that the memory used to generate it isn't counted in the peak RSS. Results can be saved and
+compared with a baseline to catch regressions
+
+Run from the repository root with `python -m benchmarks.pipeline --scales 1000 10000 100000`
+"""
+import argparse
+import concurrent.futures
+import json
+import multiprocessing
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.corpus import CorpusGenerator, parse_shares
+
+DEFAULT_SCALES = (1_000, 10_000, 100_000)
+PHASES = ("pre_process", "prepare_folders", "sort")
+# Phases this much faster are too short for their relative slowdown to mean anything
+MIN_REGRESSION_SECONDS = 0.1
+
+
+def get_peak_rss() -> int:
+    """
+    Returns the peak resident set size of this process in bytes
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def generate_corpus(root: str, args: argparse.Namespace) -> dict[str, int]:
+    """
+    Generates a corpus of args.files files under root and returns the number of every kind
+    """
+    return CorpusGenerator(root, args.seed, args.mix, args.rates).generate(args.files)
+
+
+def run_scale(args: argparse.Namespace) -> dict:
+    """
+    Generates a corpus of args.files files, sorts it and returns the time of every phase
+    """
+    from main import DupeCleaner
+
+    with tempfile.TemporaryDirectory(dir=args.temp_dir) as root:
+        start = time.perf_counter()
+        # Generating the corpus decodes and encodes media, which would otherwise set the peak
+        with concurrent.futures.ProcessPoolExecutor(
+                max_workers=1, mp_context=multiprocessing.get_context("spawn")) as executor:
+            counts = executor.submit(generate_corpus, root, args).result()
+        generate_seconds = time.perf_counter() - start
+        corpus_bytes = sum(os.path.getsize(os.path.join(directory, name))
+                           for directory, _, names in os.walk(root) for name in names)
+        rss_before = get_peak_rss()
+
+        cleaner = DupeCleaner(root + "/", workers=args.workers,
+                              image_threshold=args.image_threshold,
+                              text_threshold=args.text_threshold, staged=args.staged,
+                              perceptual=args.perceptual, move_workers=args.move_workers)
+        result = {"files": args.files, "bytes": corpus_bytes, "corpus": counts,
+                  "generate_seconds": generate_seconds, "phases": {}}
+        for phase in PHASES:
+            start = time.perf_counter()
+            getattr(cleaner, phase)()
+            seconds = time.perf_counter() - start
+            result["phases"][phase] = {
+                "seconds": seconds,
+                "files_per_second": args.files / seconds if seconds else 0.0,
+                "bytes_per_second": corpus_bytes / seconds if seconds else 0.0
+            }
+        cleaner.close()
+        result["groups"] = sum(len(file_dict) for file_dict in cleaner.files.values())
+        result["peak_rss"] = get_peak_rss()
+        result["peak_rss_before"] = rss_before
+    return result
+
+
+def compare(results: list[dict], baseline: list[dict], tolerance: float) -> list[str]:
+    """
+    Returns a line for every phase that got slower, or every scale that used more memory, than
+    the baseline by more than tolerance
+    """
+    regressions = []
+    baseline_by_files = {result["files"]: result for result in baseline}
+    for result in results:
+        previous = baseline_by_files.get(result["files"])
+        if previous is None:
+            continue
+        for phase in PHASES:
+            seconds = result["phases"][phase]["seconds"]
+            previous_seconds = previous["phases"][phase]["seconds"]
+            if (seconds > previous_seconds * (1 + tolerance)
+                    and seconds - previous_seconds > MIN_REGRESSION_SECONDS):
+                regressions.append(f"{result['files']} files: {phase} took {seconds:.2f}s, "
+                                   f"{previous_seconds:.2f}s in the baseline")
+        if result["peak_rss"] > previous["peak_rss"] * (1 + tolerance):
+            regressions.append(f"{result['files']} files: peak RSS "
+                               f"{result['peak_rss'] / 1024 ** 2:.0f} MB, "
+                               f"{previous['peak_rss'] / 1024 ** 2:.0f} MB in the baseline")
+    return regressions
+
+
+def parse_args(argv: list[str]) -> argparse.Namespace:
+    """
+    Parses the command line arguments
+    """
+    parser = argparse.ArgumentParser(description="Benchmarks DupeCleaner on synthetic corpora")
+    parser.add_argument("--scales", type=int, nargs="+", default=DEFAULT_SCALES,
+                        help="numbers of files to benchmark with")
+    parser.add_argument("--files", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--mix", type=parse_shares,
+                        help="share of every kind of file, e.g. images=0.6,videos=0.05,"
+                             "texts=0.15,others=0.2")
+    parser.add_argument("--rates", type=parse_shares,
+                        help="share of duplicates and damaged files, e.g. exact=0.1,near=0.1,"
+                             "corrupt=0.02,thumbnails=0.05")
+    parser.add_argument("--temp-dir", help="directory the corpora are generated in")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--move-workers", type=int, default=1)
+    parser.add_argument("--image-threshold", type=int, default=0)
+    parser.add_argument("--text-threshold", type=int, default=0)
+    parser.add_argument("--staged", action="store_true")
+    parser.add_argument("--perceptual", action="store_true")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--baseline", help="compare the results with this JSON file")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="relative slowdown or memory growth reported as a regression")
+    return parser.parse_args(argv)
+
+
+def main(argv: list[str]):
+    """
+    Runs every scale in a child process and prints a table of the results
+    """
+    args = parse_args(argv)
+    if args.files is not None:
+        # Child process running a single scale
+        print(json.dumps(run_scale(args)))
+        return
+
+    results = []
+    for scale in args.scales:
+        command = [sys.executable, "-m", "benchmarks.pipeline", "--files", str(scale),
+                   *_strip_scales(argv)]
+        output = subprocess.run(command, stdout=subprocess.PIPE, text=True, check=True).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        results.append(result)
+        phases = "  ".join(f"{phase} {values['seconds']:7.2f}s "
+                           f"({values['files_per_second']:8.1f} files/s)"
+                           for phase, values in result["phases"].items())
+        print(f"{scale:>7} files: {phases}  peak RSS {result['peak_rss'] / 1024 ** 2:.0f} MB")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"Regression: {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+def _strip_scales(argv: list[str]) -> list[str]:
+    """
+    Returns the arguments without --scales and its values, or the output and baseline paths
+    """
+    stripped = []
+    skipping = False
+    for arg in argv:
+        if arg.startswith("--"):
+            skipping = arg in ("--scales", "--output", "--baseline")
+        if not skipping:
+            stripped.append(arg)
+    return stripped
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
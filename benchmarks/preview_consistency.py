@@ -0,0 +1,89 @@
+"""
+Checks that the fast image hashes of --fast-image-hash stay close to full-decode hashes
+
+Every image under the given directory is hashed twice, once fully decoded and once from its
+embedded preview or as a JPEG draft, and the Hamming distances between the two hashes are
+reported together with the time both took. Exits with 1 when fewer than --min-agreement of the
+images are within --threshold bits, so it can gate a change to the fast path
+
+Run from the repository root with `python -m benchmarks.preview_consistency DIRECTORY`
+"""
+import argparse
+import os
+import sys
+import time
+
+from classes.file import Image, configure_file_classes, get_file_class
+from helpers.exiftool_helper import ExiftoolHelper
+
+
+def hash_images(paths: list[str], metadata: dict[str, dict],
+                fast: bool) -> tuple[dict[str, str], float]:
+    """
+    Returns the hashes of the images that aren't bad files, by path, and the seconds it took
+    """
+    configure_file_classes({"Image": {"draft_decode": fast, "preview_hash": fast}})
+    hashes = {}
+    start = time.perf_counter()
+    for path in paths:
+        image = Image(path, metadata.get(path))
+        if not image.is_bad():
+            hashes[path] = image.get_hash()
+    return hashes, time.perf_counter() - start
+
+
+def get_distance(first: str, second: str) -> int:
+    """
+    Returns the number of differing bits of two hex hashes
+    """
+    return (int(first, 16) ^ int(second, 16)).bit_count()
+
+
+def main(argv: list[str]) -> int:
+    """
+    Compares the hashes and prints the distance distribution
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("directory", help="directory of sample images")
+    parser.add_argument("--threshold", type=int, default=4,
+                        help="Hamming distance two hashes of the same image may differ by")
+    parser.add_argument("--min-agreement", type=float, default=0.95,
+                        help="share of the images that must be within the threshold")
+    args = parser.parse_args(argv)
+
+    paths = sorted(os.path.join(directory, name)
+                   for directory, _, names in os.walk(args.directory) for name in names
+                   if get_file_class(name)[1] is Image)
+    if not paths:
+        print(f"No images under {args.directory}")
+        return 1
+    with ExiftoolHelper() as exiftool:
+        metadata = exiftool.get_metadata(paths)
+    full_hashes, full_seconds = hash_images(paths, metadata, fast=False)
+    fast_hashes, fast_seconds = hash_images(paths, metadata, fast=True)
+
+    distances = {}
+    for path, full_hash in full_hashes.items():
+        if path in fast_hashes:
+            distances[path] = get_distance(full_hash, fast_hashes[path])
+    if not distances:
+        print("None of the images could be hashed both ways")
+        return 1
+
+    print(f"{len(paths)} images, {len(distances)} hashed both ways")
+    print(f"full decode: {full_seconds:.2f}s, fast: {fast_seconds:.2f}s "
+          f"({full_seconds / max(fast_seconds, 1e-9):.1f}x)")
+    print("distance  images")
+    for distance in sorted(set(distances.values())):
+        print(f"{distance:>8}  {list(distances.values()).count(distance):>6}")
+    within = sum(distance <= args.threshold for distance in distances.values())
+    agreement = within / len(distances)
+    print(f"{agreement:.1%} within {args.threshold} bits")
+    for path, distance in sorted(distances.items(), key=lambda item: -item[1])[:10]:
+        if distance > args.threshold:
+            print(f"  {distance:>3} bits: {path}")
+    return 0 if agreement >= args.min_agreement else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -1,7 +1,12 @@
+import time
+
+
 class DateTime:
     """
     Holds datetime values
     """
+    __slots__ = ("year", "month", "day", "hour", "mins", "seconds")
+
     def __init__(self, year, month, day, hour, mins, seconds):
         self.year = year
         self.month = month
@@ -14,12 +19,21 @@ class DateTime:
         """
         returns a dictionary of itself
         """
-        return self.__dict__
+        return {name: getattr(self, name) for name in self.__slots__}
 
     @classmethod
     def from_dict(cls, dictionary):
         """
         constructs self from a dictionary
         """
-        cls.__dict__ = dictionary
-        return cls
+        return cls(**dictionary)
+
+    @classmethod
+    def from_timestamp(cls, timestamp: int):
+        """
+        constructs self from seconds since the epoch of a wall-clock time, with the zero padded
+        values exiftool uses
+        """
+        value = time.gmtime(timestamp)
+        return cls(f"{value.tm_year:04d}", f"{value.tm_mon:02d}", f"{value.tm_mday:02d}",
+                   f"{value.tm_hour:02d}", f"{value.tm_min:02d}", f"{value.tm_sec:02d}")
@@ -1,36 +1,50 @@
+import calendar
+import importlib
+import io
 import typing
-import json
 import os
 import re
-import subprocess
+import time
 from typing import Self
 
-import cv2
-import PIL
-import imagehash
-import nltk
-from simhash import Simhash
-from nltk.corpus import words
-
 from helpers import text_reader_helper
+from helpers.exiftool_helper import ExiftoolHelper
+from helpers.transfer_helper import TransferHelper
+from helpers.video_frame_helper import VideoFrameHelper
+from helpers.word_set_helper import get_word_set
 from classes.date_time import DateTime
 
-nltk.download("words")
-word_set = set(words.words())
+# The imaging, video and text libraries are slow to import, so they are only imported by the
+# File classes that use them, the first time they are used
+if typing.TYPE_CHECKING:
+    import PIL.Image
 
 class File():
     """
     Generic file object
+
+    Files only keep the few fields the tool uses, so that hundreds of thousands of them fit in
+    memory. The full exiftool metadata is dropped once the File is built, and read again from
+    the file if it is needed afterwards
     """
-    metadata: dict
+    __slots__ = ("path", "extension", "size", "modify_time", "hash_value", "is_bad_file",
+                 "duplicates", "timings", "_metadata")
     path: str
-    hash_value: str
-    is_bad_file: bool = False
-    extension = None
-    date_time: DateTime
-    destination_name: str
-
-    def __init__(self, path: str):
+    extension: str
+    # Size in bytes, parsed once from exiftool's FileSize
+    size: int
+    # Wall-clock time of exiftool's FileModifyDate as seconds since the epoch, without timezone
+    modify_time: int
+    hash_value: str | int
+    is_bad_file: bool
+    duplicates: list
+    # Seconds spent in the decode and hash stages when the File was built, for metrics
+    timings: dict[str, float]
+    # Bump whenever set_hash changes so that cached hashes are recomputed
+    hash_version: int = 1
+
+    def __init__(self, path: str, metadata: dict | None = None, cached: dict | None = None,
+                 hash_value: str | int | None = None):
         self.extension = path.split(".")[-1]
         if self._is_correct_file_type(self.extension):
             self.path = path
@@ -38,41 +52,78 @@ class File():
             raise RuntimeError(f"Incorrect filetype {self.extension} for class \
                                {self.__class__.__name__}")
         self.duplicates = []
-        self._set_metadata()
-        self.set_hash()
-        self._set_datetime()
+        self.timings = {}
+        self.is_bad_file = False
+        self._metadata = None
+        if cached is not None:
+            self._restore_cache_record(cached)
+        else:
+            self._set_metadata(metadata)
+            if hash_value is None:
+                start = time.perf_counter()
+                self.set_hash()
+                # Whatever set_hash didn't spend decoding was spent hashing
+                self.timings["hash"] = (time.perf_counter() - start
+                                        - self.timings.get("decode", 0.0))
+            else:
+                self.hash_value = hash_value
+            self._metadata = None
 
     def __gt__(self, other: Self):
-        if not self.is_bad() and other.is_bad():
-            return True
-        elif self.is_video() and not other.is_video():
-            return True
-        elif not self.is_thumbnail and other.is_thumbnail():
-            return True
-        elif self.get_file_size() > other.get_file_size():
-            return True
-        else:
-            return False
+        return self.get_rank_key() > other.get_rank_key()
 
     def __ge__(self, other: Self):
-        return self > other or self == other
+        return self.get_rank_key() >= other.get_rank_key()
 
     def __eq__(self, other: Self):
-        result = (((self.is_bad_file == other.is_bad_file) and
-                   self.is_video() == other.is_video()) and
-                   (self.is_thumbnail() == other.is_thumbnail()) and
-                   (self.get_file_size() == other.get_file_size()))
-        return result
+        return self.get_rank_key() == other.get_rank_key()
+
+    def get_rank_key(self) -> tuple[bool, bool, bool, int]:
+        """
+        Returns the key the original of a group is picked by, the highest wins: files that
+        aren't bad, then videos, then files that aren't thumbnails, then larger files
+        """
+        return (not self.is_bad_file, self.is_video(), not self.is_thumbnail(), self.size)
 
     def __str__(self):
         return self.path.split("/")[-1]
 
-    def add(self, file: Self) -> None:
+    @classmethod
+    def get_hash_version(cls) -> str:
+        """
+        Returns the version of the hashing done by set_hash, including any settings it depends on
+        """
+        return str(cls.hash_version)
+
+    def get_cache_record(self) -> dict:
         """
-        Appends a duplicate file to the duplicate list
+        Returns the values of the File that are expensive to compute, for the cache
         """
-        if file not in self.duplicates:
-            self.duplicates.append(file)
+        return {
+            "size": self.size,
+            "modify_time": self.modify_time,
+            "hash_value": self.hash_value,
+            "is_bad_file": self.is_bad_file
+        }
+
+    def _restore_cache_record(self, record: dict) -> None:
+        """
+        Restores the values stored by get_cache_record instead of recomputing them. Records
+        written before Files were made compact hold the full metadata instead
+        """
+        if "metadata" in record:
+            self._set_fields(record["metadata"])
+        else:
+            self.size = record["size"]
+            self.modify_time = record["modify_time"]
+        self.hash_value = record["hash_value"]
+        self.is_bad_file = record["is_bad_file"]
+
+    def _add_timing(self, stage: str, seconds: float) -> None:
+        """
+        Adds seconds spent in a stage to the File's timings
+        """
+        self.timings[stage] = self.timings.get(stage, 0.0) + seconds
 
     def get_extension(self):
         """
@@ -84,10 +135,11 @@ class File():
         """
         assuming all dirs end with /
         """
+        date_time = self.date_time
         output = (
-            f"{self.date_time.year}/{self.date_time.month}/{self.date_time.day}/"
-            f"{self.date_time.year}{self.date_time.month}{self.date_time.day} "
-            f"{self.date_time.hour}{self.date_time.mins}{self.date_time.seconds}"
+            f"{date_time.year}/{date_time.month}/{date_time.day}/"
+            f"{date_time.year}{date_time.month}{date_time.day} "
+            f"{date_time.hour}{date_time.mins}{date_time.seconds}"
             f".{self.extension}"
         )
         return output
@@ -98,22 +150,68 @@ class File():
         """
         return self.hash_value
 
+    @property
+    def metadata(self) -> dict:
+        """
+        The file's full exiftool metadata. It is only kept while the File is being built, and is
+        read from the file again whenever it is needed afterwards
+        """
+        if self._metadata is not None:
+            return self._metadata
+        metadata = ExiftoolHelper.get_metadata_once(self.path)
+        if metadata is None:
+            raise RuntimeError(f"Unable to read metadata for file {self.path}")
+        return metadata
+
+    @property
+    def date_time(self) -> DateTime:
+        """
+        The file's modify date
+        """
+        return DateTime.from_timestamp(self.modify_time)
+
     def get_file_size(self) -> int:
         """
         Returns the file size as a single integer
         """
-        file_size: list[str] = self.metadata["FileSize"].split(" ")
-        if file_size[1].lower()[0] == "b":
+        return self.size
+
+    @staticmethod
+    def parse_file_size(file_size: str) -> int:
+        """
+        Parses exiftool's FileSize, e.g. `12 kB`, into bytes
+        """
+        value, unit = file_size.split(" ")[:2]
+        if unit.lower()[0] == "b":
             multiplier = 1
-        elif file_size[1].lower()[0] == "k":
+        elif unit.lower()[0] == "k":
             multiplier = 1000
-        elif file_size[1].lower()[0] == "m":
+        elif unit.lower()[0] == "m":
             multiplier = 1000000
-        elif file_size[1].lower()[0] == "g":
+        elif unit.lower()[0] == "g":
             multiplier = 1000000000
         else:
             raise RuntimeError(f"File size larger than expected: {file_size}")
-        return float(file_size[0]) * multiplier
+        return int(float(value) * multiplier)
+
+    @staticmethod
+    def get_stat_modify_time(stat: os.stat_result) -> int:
+        """
+        Returns the modify time of a stat result the way parse_modify_date reads exiftool's
+        FileModifyDate, as the local wall-clock time
+        """
+        return calendar.timegm(time.localtime(stat.st_mtime))
+
+    @staticmethod
+    def parse_modify_date(modify_date: str) -> int:
+        """
+        Parses exiftool's FileModifyDate, e.g. `2016:11:22 15:37:40+08:00`, into seconds since
+        the epoch of its wall-clock time. The timezone is ignored
+        """
+        match = re.match(r"(\d+):(\d+):(\d+) (\d+):(\d+):(\d+)", modify_date)
+        if match is None:
+            raise RuntimeError(f"Unexpected modify date: {modify_date}")
+        return calendar.timegm(tuple(int(value) for value in match.groups()) + (0, 0, 0))
 
     def is_bad(self) -> bool:
         """
@@ -141,11 +239,12 @@ class File():
         """
         return ()
 
-    def move(self, new_path) -> None:
+    def move(self, new_path, transfer: TransferHelper | None = None) -> None:
         """
-        Moves the file and updates path property accordingly
+        Moves the file and updates path property accordingly. Never overwrites an existing file,
+        and copies the file when new_path is on another filesystem
         """
-        os.rename(self.path, new_path)
+        (transfer or TransferHelper()).move(self.path, new_path)
         self.path = new_path
 
 
@@ -162,24 +261,12 @@ class File():
         os.rename(self.path, new_path)
         self.path = new_path
 
-    def swap(self, file: Self) -> None:
+    def _set_fields(self, metadata: dict) -> None:
         """
-        If it turns out that the current file is a duplicate, swap its position with the 
-        other file so that it and all its duplicates are appended to the new file. Hash 
-        dictionary swap handled externally
+        Sets the fields kept from the metadata
         """
-        file.duplicates = self.duplicates
-        self.duplicates = []
-        file.add(self)
-
-    def _set_datetime(self) -> None:
-        """
-        example Modify Date = `2016:11:22 15:37:40+08:00`
-        """
-        # Remove timezone from datetime
-        modify_date: str = self.metadata["FileModifyDate"].split("+")[0]
-        modify_date = modify_date.replace(" ", ":")
-        self.date_time = DateTime(*modify_date.split(":"))
+        self.size = self.parse_file_size(metadata["FileSize"])
+        self.modify_time = self.parse_modify_date(metadata["FileModifyDate"])
 
     def _is_correct_file_type(self, extension: str) -> bool:
         """
@@ -204,28 +291,104 @@ class File():
         finally:
             self.hash_value = file_name
 
-    def _set_metadata(self) -> None:
+    def _set_metadata(self, metadata: dict | None = None) -> None:
         """
-        Set the File's metadata to the actual file's metadata
+        Set the File's metadata to the actual file's metadata. Metadata that was already fetched
+        in a batch is used as is, otherwise a one-shot exiftool call is made
         """
-        result = subprocess.run(["exiftool", "-j", self.path], capture_output=True, text=True)
-        self.metadata = json.loads(result.stdout)[0]
+        if metadata is None:
+            metadata = ExiftoolHelper.get_metadata_once(self.path)
+        if metadata is None:
+            raise RuntimeError(f"Unable to read metadata for file {self.path}")
+        self._metadata = metadata
+        self._set_fields(metadata)
 
 
 class Image(File):
     """
     Object type where similarity comparisons are made primarily based on perceptual Hashing, 
     followed by metadata analysis
+
+    With draft_decode, JPEGs are decoded at a reduced size, which is much faster for large
+    photos but gives slightly different hashes
+
+    With preview_hash, raw, layered and HEIC files are hashed from the JPEG preview exiftool
+    finds embedded in them, decoded as a draft, instead of decoding the whole file. Files
+    without a preview are decoded as usual
     """
+    __slots__ = ()
+    draft_decode: bool = False
+    preview_hash: bool = False
+    # Largest first, a thumbnail can be letterboxed or too small to hash reliably. Photoshop
+    # only embeds a thumbnail
+    PREVIEW_TAGS = ("PreviewImage", "JpgFromRaw", "OtherImage", "ThumbnailImage",
+                    "PhotoshopThumbnail")
+
+    @classmethod
+    def get_hash_version(cls) -> str:
+        version = f"{cls.hash_version}:draft" if cls.draft_decode else str(cls.hash_version)
+        return f"{version}:preview" if cls.preview_hash else version
+
+    @staticmethod
+    def get_preview_formats() -> tuple:
+        return ("ai", "dng", "heic", "psd", "tif")
+
     def set_hash(self) -> None:
         """
         Generates hash value of the image
         """
-        with PIL.Image.open(self.path) as image:
+        import PIL.Image
+
+        if self.preview_hash and self.path.endswith(self.get_preview_formats()):
+            preview = self._extract_preview()
+            if preview is not None:
+                try:
+                    with PIL.Image.open(io.BytesIO(preview)) as image:
+                        image.draft("L", (128, 128))
+                        self._hash_image(image)
+                    if not self.is_bad_file:
+                        return
+                except (OSError, ValueError):
+                    pass
+                # A broken preview doesn't make the file itself bad
+                self.is_bad_file = False
+
+        try:
+            image = PIL.Image.open(self.path)
+        except OSError as e:
+            print(f"Marking image as a bad file: {e}")
+            self.is_bad_file = True
+            File.set_hash(self)
+            return
+        with image:
+            if self.draft_decode:
+                # The same reduced size PhashHelper decodes drafts at
+                image.draft("L", (128, 128))
             self._hash_image(image)
 
-    def _hash_image(self, image: PIL.Image) -> None:
+    def _extract_preview(self) -> bytes | None:
+        """
+        Returns the largest JPEG preview embedded in the file, or None if the metadata doesn't
+        list one. Previews are extracted one file at a time when the file is hashed, so only
+        one is held in memory. Extracting counts as decoding
+        """
+        metadata = self._metadata or {}
+        tag = next((tag for tag in self.PREVIEW_TAGS if tag in metadata), None)
+        if tag is None:
+            return None
+        start = time.perf_counter()
         try:
+            return ExiftoolHelper.get_binary(self.path, tag)
+        finally:
+            self._add_timing("decode", time.perf_counter() - start)
+
+    def _hash_image(self, image: "PIL.Image.Image") -> None:
+        import imagehash
+
+        try:
+            start = time.perf_counter()
+            image.load()
+            self._add_timing("decode", time.perf_counter() - start)
             hash_size = 8
             self.hash_value = str(imagehash.phash(image, hash_size))
         except OSError:
@@ -245,14 +408,46 @@ class Video(Image):
     where the content of the video likely is as well, we will most likely get the most varied
     results across different videos. This is to cover the edge cases where the first or last 
     frame of the video are blurry or black patches from human behaviour.
+
+    Frames are grabbed from the keyframe nearest to their position with a timeout, so damaged
+    videos are marked as bad files quickly. With frame_count above 1, that many keyframes are
+    spread through the video and their pHashes are combined bit by bit by majority vote
     """
+    __slots__ = ()
+    hash_version = 2
+    # Frames are decoded by ffmpeg, not as JPEG drafts
+    draft_decode = False
+    frame_count: int = 1
+    decode_timeout: float = 10
+
+    @classmethod
+    def get_hash_version(cls) -> str:
+        # Without ffmpeg, OpenCV hashes the middle frame whatever the frame count
+        if not VideoFrameHelper.is_available():
+            return f"{cls.hash_version}:opencv"
+        return f"{cls.hash_version}:{cls.frame_count}:ffmpeg"
+
     def is_video(self):
         return True
 
-    def _extract_frame(self) -> PIL.Image:
+    def _extract_frames(self) -> list["PIL.Image.Image"]:
+        """
+        Extracts frame_count keyframes of the video, falling back to the middle frame through
+        OpenCV when ffmpeg isn't installed
+        """
+        helper = VideoFrameHelper(self.decode_timeout)
+        if not helper.is_available():
+            return [self._extract_frame()]
+        duration = helper.parse_duration(self.metadata.get("Duration"))
+        return helper.extract_keyframes(self.path, duration, self.frame_count)
+
+    def _extract_frame(self) -> "PIL.Image.Image":
         """
         Extracts the middle frame of a video to hash and recommend for similarity comparisons
         """
+        import cv2
+        import PIL.Image
+
         cap = cv2.VideoCapture(self.path)
         frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
         middle_frame = frame_count // 2
@@ -267,9 +462,36 @@ class Video(Image):
 
         raise RuntimeError(f"Unable to grab frame from video file. Path: {self.path} ")
 
-    def set_hash(self) -> str:
-        frame = self._extract_frame()
-        self._hash_image(frame)
+    def set_hash(self) -> None:
+        start = time.perf_counter()
+        try:
+            frames = self._extract_frames()
+        except (RuntimeError, OSError) as e:
+            print(f"Marking video as a bad file: {e}")
+            self.is_bad_file = True
+            File.set_hash(self)
+            return
+        finally:
+            self._add_timing("decode", time.perf_counter() - start)
+
+        if not frames:
+            print(f"Marking video as a bad file: no frames were extracted from {self.path}")
+            self.is_bad_file = True
+            File.set_hash(self)
+            return
+        if len(frames) == 1:
+            self._hash_image(frames[0])
+            return
+        import imagehash
+
+        try:
+            frame_hashes = [imagehash.phash(frame, 8).hash for frame in frames]
+        except OSError:
+            self.is_bad_file = True
+            File.set_hash(self)
+            return
+        votes = sum(frame_hash.astype(int) for frame_hash in frame_hashes)
+        self.hash_value = str(imagehash.ImageHash(votes * 2 > len(frame_hashes)))
 
     @staticmethod
     def get_allowed_formats() -> list:
@@ -284,25 +506,87 @@ class Text(File):
     together 2 word chunks to preserve some degree of order. This way, we can get a hashvalue 
     for the actual content of the text files and not allow corrupted headers and noise to
     interfere with the hashing
+
+    Documents are read and tokenized in chunks, so that memory use doesn't depend on their
+    size. max_pages and max_chars optionally cap how much of each document is read
     """
-    def _extract_partially_ordered_text(self, text: str) -> list[str]:
-        text = text.lower()
-        tokens = re.findall(r"\b[a-z]+\b", text)  # only alphabetic words
-        dictionary_words = [t for t in tokens if t in word_set]
-
-        # Zip every 2 words together to create partially ordered tokens
-        # No need to add " " because it's going to get hashed anyway
-        output = []
-        for i in range(len(dictionary_words)-1):
-            output.append("".join([dictionary_words[i], dictionary_words[i+1]]))
-        return output
+    __slots__ = ()
+    # No dictionary word is this long, so longer runs of word characters are skipped
+    MAX_WORD_LENGTH = 64
+    max_pages: int | None = None
+    max_chars: int | None = None
+
+    @classmethod
+    def get_hash_version(cls) -> str:
+        return f"{cls.hash_version}:{cls.max_pages}:{cls.max_chars}"
+
+    def _iter_partially_ordered_tokens(self, chunks: typing.Iterable[str]) -> typing.Iterator[str]:
+        """
+        Yields every pair of consecutive dictionary words of a document, read in chunks, joined
+        into one token. A run of word characters at the end of a chunk is carried over to the
+        next chunk, so the tokens are the same as those of the joined text
+        """
+        word_set = get_word_set()
+        previous_word = None
+        carry = ""
+        skipping_long_word = False
+        for chunk in chunks:
+            if skipping_long_word:
+                # Drop the rest of a run of word characters that was too long to be a word
+                run_end = re.match(r"\w*", chunk).end()
+                if run_end == len(chunk):
+                    continue
+                chunk = chunk[run_end:]
+                skipping_long_word = False
+
+            text = (carry + chunk).lower()
+            run_start = re.search(r"\w*\Z", text).start()
+            carry = text[run_start:]
+            if len(carry) > self.MAX_WORD_LENGTH:
+                carry = ""
+                skipping_long_word = True
+
+            for token in re.findall(r"\b[a-z]+\b", text[:run_start]):  # only alphabetic words
+                if token in word_set:
+                    if previous_word is not None:
+                        # No need to add " " because it's going to get hashed anyway
+                        yield "".join([previous_word, token])
+                    previous_word = token
+
+        for token in re.findall(r"\b[a-z]+\b", carry):
+            if token in word_set:
+                if previous_word is not None:
+                    yield "".join([previous_word, token])
+                previous_word = token
+
+    def _iter_timed_chunks(self, chunks: typing.Iterable[str]) -> typing.Iterator[str]:
+        """
+        Yields the chunks, adding the time spent reading them to the decode timing
+        """
+        iterator = iter(chunks)
+        while True:
+            start = time.perf_counter()
+            try:
+                chunk = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                self._add_timing("decode", time.perf_counter() - start)
+            yield chunk
 
     def set_hash(self) -> None:
-        helper = text_reader_helper.TextReaderHelper()
-        extracted_text = helper.read_file(self.path, self.extension)
-        contents = self._extract_partially_ordered_text(extracted_text)
+        helper = text_reader_helper.TextReaderHelper(self.max_pages, self.max_chars)
+        contents = self._iter_partially_ordered_tokens(
+            self._iter_timed_chunks(helper.iter_file(self.path, self.extension)))
 
-        self.hash_value = Simhash(contents).value
+        from simhash import Simhash
+
+        try:
+            self.hash_value = Simhash(contents).value
+        except RuntimeError as e:
+            print(f"Marking text as a bad file: {e}")
+            self.is_bad_file = True
+            File.set_hash(self)
 
     @staticmethod
     def get_allowed_formats() -> list:
@@ -313,8 +597,88 @@ class Other(File):
     For other files that will not have pre-processing
     Will just be sorted into a folder with other files of the same type
     """
+    __slots__ = ()
+
     def _is_correct_file_type(self, extension) -> bool:
         """
         Accepts all file types
         """
         return True
+
+
+def configure_file_classes(settings: dict[str, dict]) -> None:
+    """
+    Applies class level settings to the File classes, e.g. {"Video": {"frame_count": 3}}.
+    Also used to initialise pool worker processes
+    """
+    file_classes = {file_class.__name__: file_class
+                    for file_class in (File, Image, Video, Text, Other)}
+    for class_name, values in settings.items():
+        for name, value in values.items():
+            setattr(file_classes[class_name], name, value)
+
+
+def initialize_worker(settings: dict[str, dict]) -> None:
+    """
+    Initialises a sandboxed worker process: applies the File class settings and imports the
+    libraries the File classes use, before the worker's memory limit is applied. Libraries that
+    aren't installed are skipped, they fail when a file needs them
+    """
+    configure_file_classes(settings)
+    for module in ("numpy", "scipy.fftpack", "PIL.Image", "imagehash", "cv2", "simhash",
+                   "html2text", "pdfplumber", "docx", "extract_msg", "openpyxl", "xlrd"):
+        try:
+            importlib.import_module(module)
+        except ImportError:
+            pass
+
+
+def get_file_class(path: str) -> tuple[str, type[File]]:
+    """
+    Returns the name of the file type the path is sorted under and the File class that handles it
+    """
+    if path.endswith(Image.get_allowed_formats()):
+        return "Images", Image
+    if path.endswith(Video.get_allowed_formats()):
+        return "Images", Video
+    if path.endswith(Text.get_allowed_formats()):
+        return "Texts", Text
+    return "Others", Other
+
+
+def create_file(path: str, metadata: dict | None = None, cached: dict | None = None,
+                hash_value: str | int | None = None) -> tuple[str, File]:
+    """
+    Builds the File object matching the path's extension and returns it together with the name
+    of the file type it is sorted under
+    """
+    file_type, file_class = get_file_class(path)
+    return file_type, file_class(path, metadata, cached, hash_value)
+
+
+def create_bad_file(path: str, metadata: dict | None = None) -> tuple[str, File]:
+    """
+    Builds the File object for a file that could not be built, e.g. because reading it timed
+    out or crashed, without reading its contents. It is marked as a bad file and hashed by its
+    photorec number. Without exiftool metadata, its size and modify date come from os.stat
+    """
+    file_type, file_class = get_file_class(path)
+    this_file = file_class.__new__(file_class)
+    this_file.path = path
+    this_file.extension = path.split(".")[-1]
+    this_file.duplicates = []
+    this_file.timings = {}
+    this_file.is_bad_file = True
+    this_file._metadata = None
+    if metadata is None:
+        stat = os.stat(path)
+        metadata = {"FileSize": f"{stat.st_size} bytes",
+                    "FileModifyDate": time.strftime("%Y:%m:%d %H:%M:%S",
+                                                    time.localtime(stat.st_mtime))}
+    this_file._set_fields(metadata)
+    try:
+        File.set_hash(this_file)
+    except Warning:
+        # Not a photorec file name, hashed by its path instead
+        pass
+    return file_type, this_file
@@ -0,0 +1,137 @@
+"""
+Helper for caching File metadata and hashes between runs
+"""
+import json
+import os
+import sqlite3
+import time
+
+DEFAULT_CACHE_PATH = os.path.join(os.path.expanduser("~"), ".cache", "recovery-dupe-cleaner",
+                                  "cache.sqlite")
+
+
+class CacheHelper:
+    """
+    SQLite store of pre-processed File records.
+
+    Records are keyed on the file's identity (device, inode) so that they survive the file being
+    moved by a previous run, and are only returned while the file's size and modification time
+    are unchanged and the record was made by the same File class and hash version.
+    The store is evicted down to max_bytes of records, least recently used first. The total size
+    of the records is kept up to date as they are written, so that commits only evict once the
+    store is over max_bytes
+    """
+    COMMIT_INTERVAL = 1000
+
+    def __init__(self, path: str = DEFAULT_CACHE_PATH, max_bytes: int = 1024 ** 3):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.max_bytes = max_bytes
+        self.pending_writes = 0
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS files (
+                device INTEGER NOT NULL,
+                inode INTEGER NOT NULL,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                file_class TEXT NOT NULL,
+                hash_version TEXT NOT NULL,
+                path TEXT NOT NULL,
+                record TEXT NOT NULL,
+                record_size INTEGER NOT NULL,
+                last_used REAL NOT NULL,
+                PRIMARY KEY (device, inode)
+            )""")
+        self.connection.execute(
+            "CREATE INDEX IF NOT EXISTS files_last_used ON files (last_used)")
+        self.total_size = self.connection.execute(
+            "SELECT COALESCE(SUM(record_size), 0) FROM files").fetchone()[0]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def get_many(self, stats: dict[str, os.stat_result],
+                 versions: dict[str, tuple[str, str]]) -> dict[str, dict]:
+        """
+        Returns the cached records for every path that has a valid record.
+        versions maps each path to the (File class name, hash version) it would be built with.
+        Marking the records as used doesn't count towards the next commit, they are committed
+        with the next writes or when the store is closed
+        """
+        records = {}
+        now = time.time()
+        for path, stat in stats.items():
+            row = self.connection.execute(
+                "SELECT size, mtime_ns, file_class, hash_version, record FROM files "
+                "WHERE device = ? AND inode = ?", (stat.st_dev, stat.st_ino)).fetchone()
+            if row is None:
+                continue
+            size, mtime_ns, file_class, hash_version, record = row
+            if (size, mtime_ns) != (stat.st_size, stat.st_mtime_ns):
+                continue
+            if (file_class, str(hash_version)) != versions[path]:
+                continue
+            records[path] = json.loads(record)
+            self.connection.execute(
+                "UPDATE files SET last_used = ?, path = ? WHERE device = ? AND inode = ?",
+                (now, path, stat.st_dev, stat.st_ino))
+        return records
+
+    def put(self, file, stat: os.stat_result) -> None:
+        """
+        Stores the File's record, replacing any previous record for the same file
+        """
+        record = json.dumps(file.get_cache_record())
+        replaced = self.connection.execute(
+            "SELECT record_size FROM files WHERE device = ? AND inode = ?",
+            (stat.st_dev, stat.st_ino)).fetchone()
+        if replaced is not None:
+            self.total_size -= replaced[0]
+        self.total_size += len(record)
+        self.connection.execute(
+            "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns,
+             file.__class__.__name__, file.get_hash_version(), file.path, record, len(record),
+             time.time()))
+        self._count_write()
+
+    def _count_write(self) -> None:
+        self.pending_writes += 1
+        if self.pending_writes >= self.COMMIT_INTERVAL:
+            self.commit()
+
+    def commit(self) -> None:
+        """
+        Commits pending writes and evicts the least recently used records beyond max_bytes
+        """
+        if self.total_size > self.max_bytes:
+            self._evict()
+        self.connection.commit()
+        self.pending_writes = 0
+
+    def _evict(self) -> None:
+        """
+        Deletes the least recently used records until the store is within max_bytes
+        """
+        evicted = []
+        rows = self.connection.execute(
+            "SELECT rowid, record_size FROM files ORDER BY last_used, rowid")
+        for rowid, record_size in rows:
+            if self.total_size <= self.max_bytes:
+                break
+            evicted.append((rowid,))
+            self.total_size -= record_size
+        rows.close()
+        self.connection.executemany("DELETE FROM files WHERE rowid = ?", evicted)
+
+    def close(self) -> None:
+        """
+        Commits and closes the store
+        """
+        self.commit()
+        self.connection.close()
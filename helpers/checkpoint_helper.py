@@ -0,0 +1,139 @@
+"""
+Helper for saving and restoring the progress of a DupeCleaner run
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+
+DEFAULT_CHECKPOINT_ROOT = os.path.join(os.path.expanduser("~"), ".cache",
+                                       "recovery-dupe-cleaner", "checkpoints")
+
+
+class CheckpointHelper:
+    """
+    Persists a run as a small snapshot plus an append-only journal.
+
+    The snapshot only holds the state machine's current state and the settings the run hashed
+    files with, and is replaced atomically.
+    The journal holds one JSON line per completed file, completed directory and move, so each
+    checkpoint only costs the records added since the previous one. Move records are flushed
+    before the move is made, so a crashed run can tell which moves happened.
+
+    Journaled files are only resumed by a run with the same settings, e.g. the hashing mode and
+    the hash versions of the File classes, since their hashes can't be mixed with others
+    """
+    SNAPSHOT_NAME = "snapshot.json"
+    JOURNAL_NAME = "journal.jsonl"
+
+    def __init__(self, directory: str, interval: float = 30, settings: dict | None = None):
+        self.directory = directory
+        self.interval = interval
+        self.settings = settings
+        self.last_commit = time.monotonic()
+        self.journal = None
+        self.lock = threading.RLock()
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def get_default_directory(root_path: str) -> str:
+        """
+        Returns the checkpoint directory used for the given root path
+        """
+        digest = hashlib.sha1(os.path.abspath(root_path).encode("utf-8")).hexdigest()
+        return os.path.join(DEFAULT_CHECKPOINT_ROOT, digest)
+
+    def load(self) -> tuple[str, list[dict]]:
+        """
+        Returns the saved state and every complete journal record. A partially written last
+        record is discarded.
+
+        A checkpoint saved with other settings is discarded, unless files were already moved,
+        in which case a RuntimeError is raised, since the moves can't be forgotten
+        """
+        state = ""
+        settings = None
+        snapshot_path = os.path.join(self.directory, self.SNAPSHOT_NAME)
+        if os.path.exists(snapshot_path):
+            with open(snapshot_path, "r", encoding="utf-8") as f:
+                snapshot = json.load(f)
+            state = snapshot["state"]
+            settings = snapshot.get("settings")
+
+        records = []
+        journal_path = os.path.join(self.directory, self.JOURNAL_NAME)
+        if os.path.exists(journal_path):
+            valid_length = 0
+            with open(journal_path, "rb") as f:
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        break
+                    try:
+                        records.append(json.loads(line))
+                    except ValueError:
+                        break
+                    valid_length += len(line)
+            os.truncate(journal_path, valid_length)
+
+        if (state or records) and settings != self.settings:
+            if any(record["op"] == "move" for record in records):
+                raise RuntimeError(
+                    f"The checkpoint in {self.directory} was saved with other settings "
+                    f"({settings}) and has already moved files. Rerun with those settings to "
+                    f"finish sorting, or with --fresh to start over")
+            print("Discarding the checkpoint saved with other settings "
+                  f"({settings}), files will be pre-processed again")
+            self.clear()
+            return "", []
+        return state, records
+
+    def append(self, record: dict, flush: bool = False) -> None:
+        """
+        Appends a record to the journal. Records are buffered unless flush is set
+        """
+        line = json.dumps(record) + "\n"
+        with self.lock:
+            if self.journal is None:
+                self.journal = open(os.path.join(self.directory, self.JOURNAL_NAME), "a",
+                                    encoding="utf-8")
+            self.journal.write(line)
+            if flush:
+                self.journal.flush()
+
+    def maybe_commit(self, state: str) -> None:
+        """
+        Commits if the checkpoint interval has passed since the last commit
+        """
+        if time.monotonic() - self.last_commit >= self.interval:
+            self.commit(state)
+
+    def commit(self, state: str) -> None:
+        """
+        Makes the journal durable and atomically replaces the snapshot
+        """
+        with self.lock:
+            if self.journal is not None:
+                self.journal.flush()
+                os.fsync(self.journal.fileno())
+
+            snapshot_path = os.path.join(self.directory, self.SNAPSHOT_NAME)
+            temp_path = snapshot_path + ".tmp"
+            with open(temp_path, "w", encoding="utf-8") as f:
+                json.dump({"state": state, "settings": self.settings}, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_path, snapshot_path)
+            self.last_commit = time.monotonic()
+
+    def clear(self) -> None:
+        """
+        Removes the checkpoint once the run is complete
+        """
+        if self.journal is not None:
+            self.journal.close()
+            self.journal = None
+        for name in (self.SNAPSHOT_NAME, self.JOURNAL_NAME):
+            path = os.path.join(self.directory, name)
+            if os.path.exists(path):
+                os.remove(path)
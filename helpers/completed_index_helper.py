@@ -0,0 +1,55 @@
+"""
+Helper for tracking which files and directories have been pre-processed
+"""
+import os
+import sys
+
+
+class CompletedIndex:
+    """
+    Tracks completed files grouped by their directory, so that checking or adding a file is O(1)
+    and completing a directory drops all of its files in one step. Directory paths are interned
+    and stored once, with only the file names kept per directory
+    """
+    def __init__(self):
+        self.directories: set[str] = set()
+        self.files: dict[str, set[str]] = {}
+
+    def __len__(self):
+        return len(self.directories) + sum(len(names) for names in self.files.values())
+
+    @staticmethod
+    def _split(path: str) -> tuple[str, str]:
+        directory, name = os.path.split(os.path.normpath(path))
+        return sys.intern(directory), name
+
+    def is_directory_completed(self, path: str) -> bool:
+        """
+        Returns True if the directory has been completed
+        """
+        return sys.intern(os.path.normpath(path)) in self.directories
+
+    def is_file_completed(self, path: str) -> bool:
+        """
+        Returns True if the file, or the directory it is in, has been completed
+        """
+        directory, name = self._split(path)
+        return directory in self.directories or name in self.files.get(directory, ())
+
+    def complete_file(self, path: str) -> None:
+        """
+        Marks the file as completed
+        """
+        directory, name = self._split(path)
+        names = self.files.get(directory)
+        if names is None:
+            names = self.files[directory] = set()
+        names.add(name)
+
+    def complete_directory(self, path: str) -> None:
+        """
+        Marks the directory as completed and forgets its individual files
+        """
+        directory = sys.intern(os.path.normpath(path))
+        self.directories.add(directory)
+        self.files.pop(directory, None)
@@ -0,0 +1,64 @@
+"""
+Helper for creating and cleaning up the directories files are moved between
+"""
+import os
+import threading
+
+
+class DirectoryHelper:
+    """
+    Creates a destination directory the first time a file is moved into it and remembers it,
+    so that every directory costs one makedirs at most. The directories files are moved out of
+    are recorded, and cleaning up only tries to remove those, and their parents up to their root,
+    instead of walking the whole tree. os.rmdir fails on directories that aren't empty, so
+    every candidate costs a single syscall.
+
+    Files can be moved out of more than one tree, e.g. the recovered files and a library, so
+    more than one root can be given
+    """
+    def __init__(self, *root_paths: str):
+        self.root_paths = [os.path.abspath(root_path) for root_path in root_paths]
+        self.lock = threading.Lock()
+        self.existing: set[str] = set()
+        self.vacated: set[str] = set()
+
+    def ensure(self, directory: str) -> None:
+        """
+        Creates the directory and its parents unless they were created or seen before
+        """
+        if directory in self.existing:
+            return
+        os.makedirs(directory, exist_ok=True)
+        with self.lock:
+            self.existing.add(directory)
+
+    def record_vacated(self, directory: str) -> None:
+        """
+        Records that a file was moved out of the directory, which may have left it empty
+        """
+        if directory in self.vacated:
+            return
+        with self.lock:
+            self.vacated.add(directory)
+
+    def remove_empty(self) -> int:
+        """
+        Removes the recorded directories that are empty, and then any parents that are left
+        empty, never removing a root itself or anything outside the roots. Returns the number of
+        directories removed
+        """
+        removed = 0
+        with self.lock:
+            vacated = sorted(self.vacated, key=len, reverse=True)
+            self.vacated = set()
+        for directory in vacated:
+            directory = os.path.abspath(directory)
+            while any(directory.startswith(root_path + os.sep) for root_path in self.root_paths):
+                try:
+                    os.rmdir(directory)
+                except OSError:
+                    break
+                removed += 1
+                self.existing.discard(directory)
+                directory = os.path.dirname(directory)
+        return removed
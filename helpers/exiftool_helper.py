@@ -0,0 +1,192 @@
+"""
+Helper for reading file metadata through persistent exiftool processes
+"""
+import atexit
+import base64
+import json
+import os
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+class ExiftoolWorker:
+    """
+    A single `exiftool -stay_open True -@ -` process. Arguments are written to its stdin one
+    per line and every batch is terminated with a numbered `-execute`, whose `{ready#}` marker
+    tells us where the JSON output of that batch ends
+    """
+    def __init__(self):
+        self.process = None
+        self.lock = threading.Lock()
+        self.execute_count = 0
+
+    def start(self) -> None:
+        """
+        Starts the exiftool process if it is not already running
+        """
+        if self.is_alive():
+            return
+        self.process = subprocess.Popen(
+            ["exiftool", "-stay_open", "True", "-@", "-"],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            text=True,
+            encoding="utf-8",
+        )
+
+    def is_alive(self) -> bool:
+        """
+        Returns True if the exiftool process is running
+        """
+        return self.process is not None and self.process.poll() is None
+
+    def execute(self, paths: list[str], options: tuple[str, ...] = ()) -> list[dict]:
+        """
+        Sends a batch of paths to exiftool, with any extra options, and returns the parsed JSON
+        output
+        """
+        with self.lock:
+            self.start()
+            self.execute_count += 1
+            ready_marker = f"{{ready{self.execute_count}}}"
+            arguments = ["-j", *options, "-charset", "filename=utf8", *paths,
+                         f"-execute{self.execute_count}"]
+            try:
+                self.process.stdin.write("\n".join(arguments) + "\n")
+                self.process.stdin.flush()
+                output = []
+                while True:
+                    line = self.process.stdout.readline()
+                    if not line:
+                        raise RuntimeError("exiftool process exited unexpectedly")
+                    if line.strip() == ready_marker:
+                        break
+                    output.append(line)
+            except (OSError, RuntimeError):
+                self.kill()
+                raise
+
+        output = "".join(output).strip()
+        return json.loads(output) if output else []
+
+    def close(self) -> None:
+        """
+        Asks the exiftool process to exit
+        """
+        with self.lock:
+            if not self.is_alive():
+                return
+            try:
+                self.process.stdin.write("-stay_open\nFalse\n")
+                self.process.stdin.flush()
+                self.process.wait(timeout=5)
+            except (OSError, subprocess.TimeoutExpired):
+                self.kill()
+
+    def kill(self) -> None:
+        """
+        Forcefully stops the exiftool process
+        """
+        if self.process is not None and self.process.poll() is None:
+            self.process.kill()
+            self.process.wait()
+        self.process = None
+
+
+class ExiftoolHelper:
+    """
+    Keeps a pool of exiftool processes alive and fetches metadata for many files per round trip.
+    Falls back to a one-shot `exiftool -j <path>` call for any file a worker fails to return
+    """
+    # The process's worker for get_binary and the process it was started by
+    binary_worker: ExiftoolWorker | None = None
+    binary_worker_pid: int | None = None
+
+    def __init__(self, workers: int = 1, batch_size: int = 200):
+        self.batch_size = batch_size
+        self.workers = [ExiftoolWorker() for _ in range(max(1, workers))]
+        self.executor = ThreadPoolExecutor(max_workers=len(self.workers))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def get_metadata(self, paths: list[str]) -> dict[str, dict]:
+        """
+        Returns a dictionary of path to exiftool metadata for all given paths
+        """
+        # exiftool reads one argument per line, so these can't go through the argument file
+        batch_paths = [path for path in paths if "\n" not in path]
+        batches = [batch_paths[i:i + self.batch_size]
+                   for i in range(0, len(batch_paths), self.batch_size)]
+
+        metadata = {}
+        jobs = [self.executor.submit(self._execute_batch, self.workers[i % len(self.workers)],
+                                     batch)
+                for i, batch in enumerate(batches)]
+        for job in jobs:
+            metadata.update(job.result())
+
+        for path in paths:
+            if path not in metadata:
+                result = self.get_metadata_once(path)
+                if result is not None:
+                    metadata[path] = result
+        return metadata
+
+    def _execute_batch(self, worker: ExiftoolWorker, paths: list[str]) -> dict[str, dict]:
+        try:
+            results = worker.execute(paths)
+        except (OSError, RuntimeError, ValueError) as e:
+            print(f"exiftool worker failed, falling back to one-shot calls: {e}")
+            return {}
+        return {result["SourceFile"]: result for result in results if "SourceFile" in result}
+
+    @staticmethod
+    def get_metadata_once(path: str) -> dict | None:
+        """
+        Runs a single exiftool process for the given path
+        """
+        result = subprocess.run(["exiftool", "-j", path], capture_output=True, text=True)
+        try:
+            return json.loads(result.stdout)[0]
+        except (ValueError, IndexError):
+            return None
+
+    @classmethod
+    def get_binary(cls, path: str, tag: str) -> bytes | None:
+        """
+        Returns the binary value of the given tag, e.g. an embedded PreviewImage, or None if the
+        file doesn't have it. Every process keeps one exiftool process for this, so Files being
+        built, e.g. in sandboxed workers, read one value at a time without starting an exiftool
+        per file. Falls back to a one-shot call
+        """
+        if "\n" not in path:
+            if cls.binary_worker is None or cls.binary_worker_pid != os.getpid():
+                # A worker inherited through fork belongs to the parent
+                cls.binary_worker = ExiftoolWorker()
+                cls.binary_worker_pid = os.getpid()
+                atexit.register(cls.binary_worker.close)
+            try:
+                results = cls.binary_worker.execute([path], ("-b", f"-{tag}"))
+            except (OSError, RuntimeError, ValueError):
+                results = None
+            if results is not None:
+                value = results[0].get(tag) if results else None
+                if isinstance(value, str) and value.startswith("base64:"):
+                    return base64.b64decode(value[len("base64:"):])
+                return None
+        result = subprocess.run(["exiftool", "-b", f"-{tag}", path], capture_output=True)
+        return result.stdout or None
+
+    def close(self) -> None:
+        """
+        Stops all exiftool processes
+        """
+        for worker in self.workers:
+            worker.close()
+        self.executor.shutdown()
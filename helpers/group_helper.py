@@ -0,0 +1,110 @@
+"""
+Helper for grouping duplicate files into disjoint sets and picking every group's original
+"""
+
+
+class GroupHelper:
+    """
+    Union-find over the Files of one file type. Files added under the same hash join the same
+    group, and groups can be merged by hash, so that chains of near-duplicates end up in one
+    group even when their ends are too far apart to match directly.
+
+    Every File's ranking key is computed once when it is added. The original of every group is
+    only picked once all files are in, in a single pass over the members, instead of comparing
+    and swapping files as they arrive. Members are kept in insertion order, and the earliest of
+    equally ranked files stays the original
+    """
+    def __init__(self):
+        self.members: list = []
+        self.keys: list = []
+        self.ranks: list[tuple] = []
+        self.parents: list[int] = []
+        self.sizes: list[int] = []
+        self.by_key: dict = {}
+
+    def __len__(self):
+        return len(self.members)
+
+    def __contains__(self, key) -> bool:
+        return key in self.by_key
+
+    def add(self, file, key) -> None:
+        """
+        Adds a File under its hash, joining the group of any file added under the same hash
+        """
+        index = len(self.members)
+        self.members.append(file)
+        self.keys.append(key)
+        self.ranks.append(file.get_rank_key())
+        self.parents.append(index)
+        self.sizes.append(1)
+        other = self.by_key.get(key)
+        if other is None:
+            self.by_key[key] = index
+        else:
+            self._union(other, index)
+
+    def merge(self, key, other_key) -> None:
+        """
+        Merges the groups of the files added under the two hashes
+        """
+        self._union(self.by_key[key], self.by_key[other_key])
+
+    def _find(self, index: int) -> int:
+        parents = self.parents
+        while parents[index] != index:
+            # Path halving keeps the trees flat without recursion
+            parents[index] = parents[parents[index]]
+            index = parents[index]
+        return index
+
+    def _union(self, first: int, second: int) -> None:
+        first, second = self._find(first), self._find(second)
+        if first == second:
+            return
+        if self.sizes[first] < self.sizes[second]:
+            first, second = second, first
+        self.parents[second] = first
+        self.sizes[first] += self.sizes[second]
+
+    def get_originals(self) -> dict:
+        """
+        Picks the highest ranked File of every group as its original, sets its duplicates to
+        the rest of the group in insertion order and returns the originals by the hash of their
+        group's first file
+        """
+        roots = [self._find(index) for index in range(len(self.members))]
+        best: dict[int, int] = {}
+        first: dict[int, int] = {}
+        ranks = self.ranks
+        for index, root in enumerate(roots):
+            current = best.get(root)
+            if current is None:
+                best[root] = first[root] = index
+            elif ranks[index] > ranks[current]:
+                best[root] = index
+
+        originals = {}
+        for root, index in first.items():
+            original = self.members[best[root]]
+            original.duplicates = []
+            originals[self.keys[index]] = original
+        for index, root in enumerate(roots):
+            if index != best[root]:
+                member = self.members[index]
+                if member.duplicates:
+                    # Left over from an earlier pick where it was the original
+                    member.duplicates = []
+                self.members[best[root]].duplicates.append(member)
+        return originals
+
+    def get_group_sizes(self) -> dict[int, int]:
+        """
+        Returns the number of groups of every size
+        """
+        group_sizes = {}
+        for index, parent in enumerate(self.parents):
+            if parent == index:
+                size = self.sizes[index]
+                group_sizes[size] = group_sizes.get(size, 0) + 1
+        return group_sizes
@@ -0,0 +1,102 @@
+"""
+Helper for indexing the originals of a sorted library between runs
+"""
+import json
+import os
+import sqlite3
+import time
+from typing import Iterator
+
+LIBRARY_INDEX_NAME = ".recovery-dupe-cleaner-library.sqlite"
+
+
+class LibraryIndexHelper:
+    """
+    SQLite index of the originals in a sorted library, holding every original's path, File
+    class, hash, hash version, size and modify date, so that new recoveries can be grouped
+    against the library without re-hashing it. The index is updated in place as originals are
+    added, replaced or removed.
+
+    Only files whose hash comes from their contents are indexed. Others and bad files are hashed
+    by their photorec number, which repeats across recoveries
+    """
+    def __init__(self, library_root: str, path: str | None = None):
+        self.library_root = library_root
+        self.path = path or os.path.join(library_root, LIBRARY_INDEX_NAME)
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.connection = sqlite3.connect(self.path)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS originals (
+                path TEXT PRIMARY KEY,
+                file_type TEXT NOT NULL,
+                file_class TEXT NOT NULL,
+                hash_version TEXT NOT NULL,
+                hash_value TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                modify_time INTEGER NOT NULL,
+                indexed_at REAL NOT NULL
+            )""")
+        self.connection.execute(
+            "CREATE INDEX IF NOT EXISTS originals_hash ON originals (file_type, hash_value)")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def __len__(self):
+        return self.connection.execute("SELECT COUNT(*) FROM originals").fetchone()[0]
+
+    def iter_originals(self, versions: dict[str, str]) -> Iterator[tuple[str, str, dict]]:
+        """
+        Yields the (file type, path, cache record) of every indexed original that was hashed
+        with the current hash version of its File class. versions maps File class names to
+        their hash versions
+        """
+        rows = self.connection.execute(
+            "SELECT path, file_type, file_class, hash_version, hash_value, size, modify_time "
+            "FROM originals ORDER BY indexed_at, rowid")
+        for path, file_type, file_class, hash_version, hash_value, size, modify_time in rows:
+            if versions.get(file_class) != hash_version:
+                continue
+            yield file_type, path, {"size": size, "modify_time": modify_time,
+                                    "hash_value": json.loads(hash_value), "is_bad_file": False}
+
+    def count_stale(self, versions: dict[str, str]) -> int:
+        """
+        Returns the number of originals hashed with another hash version, which are skipped
+        """
+        return sum(1 for _, _, file_class, hash_version in self.connection.execute(
+            "SELECT path, file_type, file_class, hash_version FROM originals")
+            if versions.get(file_class) != hash_version)
+
+    def put(self, path: str, file_type: str, file) -> None:
+        """
+        Adds or replaces the original at path
+        """
+        self.connection.execute(
+            "INSERT OR REPLACE INTO originals VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (path, file_type, file.__class__.__name__, file.get_hash_version(),
+             json.dumps(file.get_hash()), file.get_file_size(), file.modify_time, time.time()))
+
+    def remove(self, path: str) -> None:
+        """
+        Removes the original at path, e.g. because it was replaced by a better copy
+        """
+        self.connection.execute("DELETE FROM originals WHERE path = ?", (path,))
+
+    def commit(self) -> None:
+        """
+        Commits pending changes
+        """
+        self.connection.commit()
+
+    def close(self) -> None:
+        """
+        Commits and closes the index
+        """
+        self.commit()
+        self.connection.close()
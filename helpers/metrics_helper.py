@@ -0,0 +1,309 @@
+"""
+Helper for measuring where a run spends its time
+"""
+import contextlib
+import json
+import math
+import threading
+import time
+import typing
+
+# Histogram buckets are powers of two of microseconds, from 1us up to about 18 minutes
+BUCKET_COUNT = 31
+
+
+class LatencyHistogram:
+    """
+    Counts latencies in power of two buckets, so that recording is O(1) and percentiles can be
+    estimated without keeping every sample
+    """
+    def __init__(self):
+        self.buckets = [0] * BUCKET_COUNT
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = 0.0
+
+    def record(self, seconds: float) -> None:
+        """
+        Adds a latency in seconds
+        """
+        microseconds = seconds * 1_000_000
+        bucket = 0 if microseconds < 1 else min(int(math.log2(microseconds)), BUCKET_COUNT - 1)
+        self.buckets[bucket] += 1
+        self.count += 1
+        self.total += seconds
+        self.min = min(self.min, seconds)
+        self.max = max(self.max, seconds)
+
+    def get_percentile(self, percentile: float) -> float:
+        """
+        Returns the upper bound of the bucket holding the given percentile, in seconds
+        """
+        if not self.count:
+            return 0.0
+        rank = percentile / 100 * self.count
+        seen = 0
+        for bucket, count in enumerate(self.buckets):
+            seen += count
+            if seen >= rank:
+                return min(2 ** (bucket + 1) / 1_000_000, self.max)
+        return self.max
+
+    def to_dict(self) -> dict:
+        """
+        Returns the summary of the histogram, in seconds
+        """
+        return {
+            "count": self.count,
+            "total": self.total,
+            "mean": self.total / self.count if self.count else 0.0,
+            "min": self.min if self.count else 0.0,
+            "max": self.max,
+            "p50": self.get_percentile(50),
+            "p90": self.get_percentile(90),
+            "p99": self.get_percentile(99),
+            "buckets": {f"<{2 ** (i + 1)}us": count
+                        for i, count in enumerate(self.buckets) if count}
+        }
+
+
+class StageMetrics:
+    """
+    Latencies and throughput of a single stage for a single file type
+    """
+    def __init__(self):
+        self.latency = LatencyHistogram()
+        self.files = 0
+        self.bytes = 0
+
+    def to_dict(self) -> dict:
+        """
+        Returns the summary of the stage, with its throughput over the time spent in it
+        """
+        seconds = self.latency.total
+        return {
+            "files": self.files,
+            "bytes": self.bytes,
+            "files_per_second": self.files / seconds if seconds else 0.0,
+            "bytes_per_second": self.bytes / seconds if seconds else 0.0,
+            "latency": self.latency.to_dict()
+        }
+
+
+class MetricsHelper:
+    """
+    Records per stage and per file type counters and latency histograms, and prints a progress
+    line every interval seconds. Stages include scandir, exiftool, decode, hash, compare, select
+    and move. Recording is thread-safe so that move workers can share one helper
+    """
+    def __init__(self, progress_interval: float = 10):
+        self.progress_interval = progress_interval
+        self.lock = threading.Lock()
+        self.stages: dict[tuple[str, str], StageMetrics] = {}
+        self.counters: dict[str, int] = {}
+        self.distributions: dict[str, dict[int, int]] = {}
+        self.start_time = time.perf_counter()
+        self.progress_name = None
+        self.progress_total = None
+        self.progress_files = 0
+        self.progress_bytes = 0
+        self.progress_start = 0.0
+        self.last_progress = 0.0
+
+    def record(self, stage: str, file_type: str, seconds: float, files: int = 1,
+               size: int = 0) -> None:
+        """
+        Records one operation of a stage that took seconds and handled files files of size bytes
+        """
+        with self.lock:
+            metrics = self.stages.get((stage, file_type))
+            if metrics is None:
+                metrics = self.stages[(stage, file_type)] = StageMetrics()
+            metrics.latency.record(seconds)
+            metrics.files += files
+            metrics.bytes += size
+
+    @contextlib.contextmanager
+    def timer(self, stage: str, file_type: str, files: int = 1, size: int = 0):
+        """
+        Records the time spent in the with block as one operation of the stage
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, file_type, time.perf_counter() - start, files, size)
+
+    def iter_timed(self, stage: str, file_type: str, iterable: typing.Iterable,
+                   get_files: typing.Callable[[typing.Any], int] = lambda item: 1
+                   ) -> typing.Iterator:
+        """
+        Yields the items of iterable, recording the time spent producing each one as one
+        operation of the stage. get_files returns how many files an item holds
+        """
+        iterator = iter(iterable)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            self.record(stage, file_type, time.perf_counter() - start, get_files(item))
+            yield item
+
+    def count(self, name: str, amount: int = 1) -> None:
+        """
+        Increments a counter
+        """
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def set_distribution(self, name: str, distribution: dict[int, int]) -> None:
+        """
+        Sets a distribution of counts by value, e.g. the number of groups of every size
+        """
+        with self.lock:
+            self.distributions[name] = dict(sorted(distribution.items()))
+
+    def start_progress(self, name: str, total: int | None = None) -> None:
+        """
+        Starts reporting the progress of a phase. Without a total, no ETA is given
+        """
+        with self.lock:
+            self.progress_name = name
+            self.progress_total = total
+            self.progress_files = 0
+            self.progress_bytes = 0
+            self.progress_start = self.last_progress = time.perf_counter()
+
+    def advance(self, files: int = 1, size: int = 0) -> None:
+        """
+        Adds finished files to the current phase, printing a progress line when one is due
+        """
+        with self.lock:
+            self.progress_files += files
+            self.progress_bytes += size
+            now = time.perf_counter()
+            if now - self.last_progress < self.progress_interval:
+                return
+            self.last_progress = now
+        print(self.get_progress_line())
+
+    def get_progress_line(self) -> str:
+        """
+        Returns the progress of the current phase with its throughput and ETA
+        """
+        elapsed = max(time.perf_counter() - self.progress_start, 1e-9)
+        files_per_second = self.progress_files / elapsed
+        total = "?" if self.progress_total is None else self.progress_total
+        line = (f"[{self.progress_name}] {self.progress_files}/{total} files, "
+                f"{files_per_second:.1f} files/s, "
+                f"{self.progress_bytes / elapsed / 1024 ** 2:.1f} MB/s")
+        if self.progress_total is not None and files_per_second > 0:
+            remaining = max(self.progress_total - self.progress_files, 0) / files_per_second
+            line += f", ETA {time.strftime('%H:%M:%S', time.gmtime(remaining))}"
+        return line
+
+    def to_dict(self) -> dict:
+        """
+        Returns every metric as a JSON serialisable dictionary
+        """
+        with self.lock:
+            stages = {}
+            for (stage, file_type), metrics in sorted(self.stages.items()):
+                stages.setdefault(stage, {})[file_type] = metrics.to_dict()
+            return {
+                "elapsed": time.perf_counter() - self.start_time,
+                "counters": dict(self.counters),
+                "distributions": {name: dict(distribution)
+                                  for name, distribution in self.distributions.items()},
+                "stages": stages
+            }
+
+    @staticmethod
+    def _format_distribution(distribution: dict[int, int]) -> str:
+        """
+        Formats counts by value in power of two buckets, e.g. `1: 900, 2: 40, 3-4: 12`
+        """
+        buckets: dict[int, int] = {}
+        for value, count in distribution.items():
+            bucket = 1 << max(value - 1, 0).bit_length()
+            buckets[bucket] = buckets.get(bucket, 0) + count
+        return ", ".join(f"{bucket // 2 + 1 if bucket > 2 else bucket}"
+                         f"{f'-{bucket}' if bucket > 2 else ''}: {count}"
+                         for bucket, count in sorted(buckets.items()))
+
+    def write_json(self, path: str) -> None:
+        """
+        Writes every metric to path as JSON
+        """
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+    def get_report(self) -> str:
+        """
+        Returns a table of the time spent in every stage and file type
+        """
+        metrics = self.to_dict()
+        lines = [f"{'stage':<10}{'type':<8}{'files':>9}{'MB':>10}{'seconds':>10}"
+                 f"{'files/s':>10}{'p50 ms':>9}{'p99 ms':>9}"]
+        for stage, file_types in metrics["stages"].items():
+            for file_type, stage_metrics in file_types.items():
+                latency = stage_metrics["latency"]
+                lines.append(
+                    f"{stage:<10}{file_type:<8}{stage_metrics['files']:>9}"
+                    f"{stage_metrics['bytes'] / 1024 ** 2:>10.1f}{latency['total']:>10.2f}"
+                    f"{stage_metrics['files_per_second']:>10.1f}"
+                    f"{latency['p50'] * 1000:>9.2f}{latency['p99'] * 1000:>9.2f}")
+        for name, value in metrics["counters"].items():
+            lines.append(f"{name}: {value}")
+        for name, distribution in metrics["distributions"].items():
+            lines.append(f"{name}: {self._format_distribution(distribution)}")
+        lines.append(f"Total time: {metrics['elapsed']:.1f}s")
+        return "\n".join(lines)
+
+
+@contextlib.contextmanager
+def run_profiler(kind: str | None, output: str | None = None):
+    """
+    Profiles the with block with cProfile or pyinstrument, printing the results at its end.
+    cProfile stats are also dumped to output when given, pyinstrument's report is saved there
+    as HTML
+    """
+    if kind is None:
+        yield
+        return
+
+    if kind == "cprofile":
+        import cProfile
+        import pstats
+
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            if output is not None:
+                profiler.dump_stats(output)
+            pstats.Stats(profiler).sort_stats("cumulative").print_stats(30)
+    elif kind == "pyinstrument":
+        try:
+            from pyinstrument import Profiler
+        except ImportError as e:
+            raise RuntimeError("pyinstrument is not installed, install it with "
+                               "`pip install pyinstrument` or use cprofile") from e
+
+        profiler = Profiler()
+        profiler.start()
+        try:
+            yield
+        finally:
+            profiler.stop()
+            if output is not None:
+                with open(output, "w", encoding="utf-8") as f:
+                    f.write(profiler.output_html())
+            print(profiler.output_text(unicode=True, color=False))
+    else:
+        raise RuntimeError(f"Unknown profiler: {kind}")
@@ -0,0 +1,67 @@
+"""
+Helper for planning file moves with all destination name collisions resolved up front
+"""
+import os
+
+
+class PlannedMove:
+    """
+    A single planned move of a File.
+    category is the folder it is sorted under (Originals, Duplicates, Bad Files or Others) and
+    group is the hash of the duplicate group the File belongs to
+    """
+    __slots__ = ("file", "source", "destination", "category", "file_type", "group")
+
+    def __init__(self, file, destination: str, category: str, file_type: str, group):
+        self.file = file
+        self.source = file.path
+        self.destination = destination
+        self.category = category
+        self.file_type = file_type
+        self.group = group
+
+
+class MovePlanHelper:
+    """
+    Hands out unique destination paths. The names already present in a destination directory
+    are listed once, and collisions get a `#n#` suffix before the extension, e.g.
+    `20161122 153740#1#.jpg`, picked deterministically in the order paths are reserved
+    """
+    def __init__(self):
+        self.taken_names: dict[str, set[str]] = {}
+        self.next_suffixes: dict[tuple[str, str], int] = {}
+
+    def _get_taken_names(self, directory: str) -> set[str]:
+        taken = self.taken_names.get(directory)
+        if taken is None:
+            try:
+                taken = set(os.listdir(directory))
+            except FileNotFoundError:
+                taken = set()
+            self.taken_names[directory] = taken
+        return taken
+
+    def reserve(self, path: str) -> str:
+        """
+        Returns the given path, or the first free `#n#` variant of it, and marks it as taken
+        """
+        directory, file_name = os.path.split(path)
+        taken = self._get_taken_names(directory)
+        candidate = file_name
+        if candidate in taken:
+            name, extension = os.path.splitext(file_name)
+            suffix = self.next_suffixes.get((directory, file_name), 1)
+            candidate = f"{name}#{suffix}#{extension}"
+            while candidate in taken:
+                suffix += 1
+                candidate = f"{name}#{suffix}#{extension}"
+            self.next_suffixes[(directory, file_name)] = suffix + 1
+        taken.add(candidate)
+        return os.path.join(directory, candidate)
+
+    def claim(self, path: str) -> None:
+        """
+        Marks an existing path as taken without resolving collisions
+        """
+        directory, file_name = os.path.split(path)
+        self._get_taken_names(directory).add(file_name)
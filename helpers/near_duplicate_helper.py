@@ -0,0 +1,125 @@
+"""
+Helper for finding near-duplicate hashes within a Hamming distance
+"""
+
+
+def hamming_distance(first: int, second: int) -> int:
+    """
+    Returns the number of bits that differ between two integer hashes
+    """
+    return (first ^ second).bit_count()
+
+
+class BKTree:
+    """
+    BK-tree over integer hashes using the Hamming distance.
+
+    Every child of a node is stored under its distance to that node, so by the triangle
+    inequality a search within a threshold only needs to visit the children whose distance is
+    within the threshold of the query's distance to the node. Small thresholds visit a small
+    fraction of the tree
+    """
+    VALUE, ITEM, ORDER, CHILDREN = range(4)
+
+    def __init__(self):
+        self.root = None
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def add(self, value: int, item) -> None:
+        """
+        Adds an item under the given integer hash
+        """
+        node = [value, item, self.size, {}]
+        self.size += 1
+        if self.root is None:
+            self.root = node
+            return
+
+        current = self.root
+        while True:
+            distance = hamming_distance(value, current[self.VALUE])
+            child = current[self.CHILDREN].get(distance)
+            if child is None:
+                current[self.CHILDREN][distance] = node
+                return
+            current = child
+
+    def find(self, value: int, threshold: int) -> list[tuple[int, int, object]]:
+        """
+        Returns (distance, insertion order, item) for every item within the threshold
+        """
+        matches = []
+        if self.root is None:
+            return matches
+
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            distance = hamming_distance(value, node[self.VALUE])
+            if distance <= threshold:
+                matches.append((distance, node[self.ORDER], node[self.ITEM]))
+            for child_distance, child in node[self.CHILDREN].items():
+                if distance - threshold <= child_distance <= distance + threshold:
+                    stack.append(child)
+        return matches
+
+
+class SimhashIndex:
+    """
+    Banded table index over 64-bit Simhash values for a fixed maximum distance k.
+
+    The hash is split into k + 1 bands and every band gets its own table. Two hashes within k
+    bits of each other differ in at most k bands, so they share at least one band exactly and
+    a query only compares against the hashes in its own k + 1 buckets
+    """
+    def __init__(self, max_distance: int, bits: int = 64):
+        self.max_distance = max_distance
+        self.size = 0
+        band_count = max_distance + 1
+        self.bands = []
+        offset = 0
+        for band in range(band_count):
+            width = bits // band_count + (1 if band < bits % band_count else 0)
+            self.bands.append((offset, (1 << width) - 1))
+            offset += width
+        self.tables: list[dict[int, list[tuple[int, int, object]]]] = [{} for _ in self.bands]
+
+    def __len__(self):
+        return self.size
+
+    def add(self, value: int, item) -> None:
+        """
+        Adds an item under the given Simhash value
+        """
+        entry = (value, self.size, item)
+        self.size += 1
+        for table, (offset, mask) in zip(self.tables, self.bands):
+            key = (value >> offset) & mask
+            bucket = table.get(key)
+            if bucket is None:
+                table[key] = [entry]
+            else:
+                bucket.append(entry)
+
+    def find(self, value: int, threshold: int | None = None) -> list[tuple[int, int, object]]:
+        """
+        Returns (distance, insertion order, item) for every item within the threshold, which
+        can't be larger than the index's max_distance
+        """
+        if threshold is None:
+            threshold = self.max_distance
+        if threshold > self.max_distance:
+            raise ValueError(f"Threshold {threshold} is larger than the index's maximum "
+                             f"distance {self.max_distance}")
+        matches = {}
+        for table, (offset, mask) in zip(self.tables, self.bands):
+            for other_value, order, item in table.get((value >> offset) & mask, ()):
+                if order in matches:
+                    continue
+                distance = hamming_distance(value, other_value)
+                if distance <= threshold:
+                    matches[order] = (distance, order, item)
+        return list(matches.values())
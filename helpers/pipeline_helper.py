@@ -0,0 +1,132 @@
+"""
+Helper for pre-processing a tree as a pipeline of concurrent stages
+"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from helpers.walker_helper import walk_files
+
+
+class PipelineBatch:
+    """
+    A batch of files from one directory as it moves through the pipeline
+    """
+    __slots__ = ("sequence", "directory", "entries", "is_last_batch", "stats", "cached",
+                 "metadata", "built")
+
+    def __init__(self, sequence: int, directory: str, entries: dict, is_last_batch: bool):
+        self.sequence = sequence
+        self.directory = directory
+        self.entries = entries
+        self.is_last_batch = is_last_batch
+        self.stats = {}
+        self.cached = {}
+        self.metadata = {}
+        self.built = []
+
+
+class PipelineHelper:
+    """
+    Pre-processes the tree under the cleaner's root path as a chain of stages connected by
+    bounded queues, so that walking, exiftool, hashing and indexing overlap instead of taking
+    turns:
+
+        walk -> metadata -> hash -> index
+
+    Walking, exiftool calls and hashing run in threads, coordinated by an asyncio event loop.
+    A stage that falls behind fills its input queue, which blocks the stages before it, so
+    memory stays bounded by queue_size batches per stage. metadata_concurrency batches can be
+    waiting on exiftool at once. Hashing handles one batch at a time, spread over the cleaner's
+    worker processes. Batches can finish the metadata stage out of order, so the index stage
+    adds them in walk order to keep the groups, and which file of a group is the original,
+    the same as without the pipeline.
+
+    Cache lookups and everything that touches the cleaner's state run on the event loop's
+    thread. Files are only moved once the index is sealed, since an original can still be
+    replaced by a later duplicate until every file has been indexed
+    """
+    def __init__(self, cleaner, metadata_concurrency: int = 2, queue_size: int = 4):
+        self.cleaner = cleaner
+        self.metadata_concurrency = max(1, metadata_concurrency)
+        self.queue_size = max(1, queue_size)
+
+    def run(self) -> None:
+        """
+        Runs the pipeline until every file has been indexed
+        """
+        asyncio.run(self._run())
+
+    async def _run(self) -> None:
+        walk_queue = asyncio.Queue(self.queue_size)
+        metadata_queue = asyncio.Queue(self.queue_size)
+        index_queue = asyncio.Queue(self.queue_size)
+        with ThreadPoolExecutor(max_workers=self.metadata_concurrency + 2) as threads:
+            async with asyncio.TaskGroup() as tasks:
+                tasks.create_task(self._walk(threads, walk_queue))
+                for _ in range(self.metadata_concurrency):
+                    tasks.create_task(self._fetch_metadata(threads, walk_queue, metadata_queue))
+                tasks.create_task(self._hash(threads, metadata_queue, index_queue))
+                tasks.create_task(self._index(index_queue))
+
+    async def _walk(self, threads: ThreadPoolExecutor, output: asyncio.Queue) -> None:
+        loop = asyncio.get_running_loop()
+        completed = self.cleaner.state["completed"]
+        walker = walk_files(self.cleaner.root_path, self.cleaner.WALK_BATCH_SIZE,
+                            completed.is_directory_completed)
+        sequence = 0
+        while True:
+            batch = await loop.run_in_executor(threads, next, walker, None)
+            if batch is None:
+                break
+            directory, entries, is_last_batch = batch
+            if completed.is_directory_completed(directory):
+                continue
+            if self.cleaner.verbose:
+                print(f"Pre-processing {len(entries)} files in {directory}")
+            pending_entries = {entry.path: entry for entry in entries
+                               if self.cleaner._is_pending(entry.path)}
+            await output.put(PipelineBatch(sequence, directory, pending_entries, is_last_batch))
+            sequence += 1
+        for _ in range(self.metadata_concurrency):
+            await output.put(None)
+
+    async def _fetch_metadata(self, threads: ThreadPoolExecutor, batches: asyncio.Queue,
+                              output: asyncio.Queue) -> None:
+        loop = asyncio.get_running_loop()
+        while (batch := await batches.get()) is not None:
+            paths = list(batch.entries)
+            batch.stats, batch.cached = self.cleaner._lookup_cached(paths, batch.entries)
+            batch.metadata = await loop.run_in_executor(
+                threads, self.cleaner._fetch_metadata, paths, batch.cached)
+            await output.put(batch)
+        await output.put(None)
+
+    async def _hash(self, threads: ThreadPoolExecutor, batches: asyncio.Queue,
+                    output: asyncio.Queue) -> None:
+        loop = asyncio.get_running_loop()
+        running = self.metadata_concurrency
+        while running:
+            batch = await batches.get()
+            if batch is None:
+                running -= 1
+                continue
+            batch.built = await loop.run_in_executor(
+                threads, self.cleaner._build_files, list(batch.entries), batch.metadata,
+                batch.cached, {})
+            await output.put(batch)
+        await output.put(None)
+
+    async def _index(self, batches: asyncio.Queue) -> None:
+        waiting = {}
+        next_sequence = 0
+        while (batch := await batches.get()) is not None:
+            waiting[batch.sequence] = batch
+            while next_sequence in waiting:
+                batch = waiting.pop(next_sequence)
+                self.cleaner._index_files(list(batch.entries), batch.built, batch.stats,
+                                          batch.cached)
+                if batch.is_last_batch:
+                    self.cleaner._complete_directory(batch.directory)
+                elif self.cleaner.checkpoint is not None:
+                    self.cleaner.checkpoint.maybe_commit(self.cleaner.state["state"])
+                next_sequence += 1
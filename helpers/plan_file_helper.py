@@ -0,0 +1,118 @@
+"""
+Helper for exporting sort plans and replaying or reversing them
+"""
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator
+
+from helpers.checkpoint_helper import CheckpointHelper
+from helpers.directory_helper import DirectoryHelper
+from helpers.transfer_helper import TransferHelper
+
+PLAN_VERSION = 1
+
+
+class PlanFileHelper:
+    """
+    Reads and writes sort plans as JSON lines. The first line is a header holding the root path,
+    the checkpoint directory of the run that made the plan and the number of moves, followed by
+    one line per move with its source, destination, category (Originals, Duplicates, Bad Files
+    or Others), file type and duplicate group
+    """
+    def __init__(self, transfer: TransferHelper | None = None, workers: int = 1):
+        self.transfer = transfer or TransferHelper()
+        self.workers = workers
+        self.directories: DirectoryHelper | None = None
+
+    @staticmethod
+    def write(path: str, root_path: str, moves, checkpoint_directory: str | None = None) -> None:
+        """
+        Streams the planned moves to the plan file
+        """
+        temp_path = path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            f.write(json.dumps({"version": PLAN_VERSION, "root_path": root_path,
+                                "checkpoint": checkpoint_directory,
+                                "moves": len(moves)}) + "\n")
+            for move in moves:
+                f.write(json.dumps({
+                    "source": move.source,
+                    "destination": move.destination,
+                    "category": move.category,
+                    "file_type": move.file_type,
+                    "group": move.group
+                }) + "\n")
+        os.replace(temp_path, path)
+
+    @staticmethod
+    def read(path: str) -> tuple[dict, Iterator[dict]]:
+        """
+        Returns the plan's header and a lazy iterator over its moves
+        """
+        f = open(path, "r", encoding="utf-8")
+        header = json.loads(f.readline())
+        if header.get("version") != PLAN_VERSION:
+            f.close()
+            raise RuntimeError(f"Unsupported plan version {header.get('version')} in {path}")
+
+        def moves():
+            with f:
+                for line in f:
+                    yield json.loads(line)
+        return header, moves()
+
+    def _move_path(self, source: str, destination: str) -> bool:
+        """
+        Moves source to destination without overwriting anything. Returns False if the move was
+        already made
+        """
+        if not os.path.exists(source) and os.path.exists(destination):
+            return False
+        self.directories.ensure(os.path.dirname(destination))
+        self.transfer.move(source, destination)
+        self.directories.record_vacated(os.path.dirname(source))
+        return True
+
+    def execute(self, path: str) -> int:
+        """
+        Makes every move of a saved plan, skipping moves that were already made. Moves into the
+        same directory are made in plan order, and with more than one worker, directories are
+        handled in parallel. The source directories that are left empty are removed. Returns the
+        number of files moved.
+
+        The checkpoint of the run that made the plan is cleared first, since its files are about
+        to move and a later run must pre-process the tree again instead of resuming it
+        """
+        header, moves = self.read(path)
+        if header.get("checkpoint") and os.path.isdir(header["checkpoint"]):
+            CheckpointHelper(header["checkpoint"]).clear()
+        self.directories = DirectoryHelper(header["root_path"])
+        moves_by_directory: dict[str, list[dict]] = {}
+        for move in moves:
+            moves_by_directory.setdefault(os.path.dirname(move["destination"]), []).append(move)
+
+        def move_directory(directory_moves: list[dict]) -> int:
+            return sum(self._move_path(move["source"], move["destination"])
+                       for move in directory_moves)
+
+        if self.workers <= 1:
+            moved = sum(map(move_directory, moves_by_directory.values()))
+        else:
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                moved = sum(executor.map(move_directory, moves_by_directory.values()))
+        self.directories.remove_empty()
+        return moved
+
+    def undo(self, path: str) -> int:
+        """
+        Moves every file of a saved plan back to its source, in reverse order, and removes the
+        destination directories that are left empty. Returns the number of files moved
+        """
+        header, moves = self.read(path)
+        self.directories = DirectoryHelper(header["root_path"])
+        moved = 0
+        for move in reversed(list(moves)):
+            moved += self._move_path(move["destination"], move["source"])
+        self.directories.remove_empty()
+        return moved
@@ -0,0 +1,247 @@
+"""
+Helper for running untrusted work in isolated, recyclable worker processes
+"""
+import multiprocessing
+import multiprocessing.connection
+import time
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+# Errors that come from the worker's environment rather than from the task's input, e.g. a
+# library that can't be loaded, which would fail every task the same way
+ENVIRONMENT_ERRORS = (ImportError,)
+
+
+class SandboxFailure:
+    """
+    Result of a task that raised, timed out, ran out of memory or crashed its worker. fatal is
+    set when the task failed because of the worker's environment, see ENVIRONMENT_ERRORS, or
+    because its worker couldn't start
+    """
+    def __init__(self, reason: str, fatal: bool = False):
+        self.reason = reason
+        self.fatal = fatal
+
+    def __str__(self):
+        return self.reason
+
+
+class _WorkerStarted:
+    """
+    Sent by a worker once it has started, before the result of its first task
+    """
+
+
+def _worker_loop(connection, initializer, initargs, memory_limit):
+    """
+    Runs tasks received over the connection until told to stop. The initializer runs before
+    the memory limit is applied, so that it can import the libraries the tasks need
+    """
+    if initializer is not None:
+        try:
+            initializer(*initargs)
+        except Exception as e:
+            connection.send(SandboxFailure(f"couldn't start its worker, the initializer raised "
+                                           f"{e!r}", fatal=True))
+            return
+    if memory_limit is not None and resource is not None:
+        try:
+            resource.setrlimit(resource.RLIMIT_AS, (memory_limit, memory_limit))
+        except (ValueError, OSError):
+            pass
+    connection.send(_WorkerStarted())
+
+    while True:
+        try:
+            task = connection.recv()
+        except EOFError:
+            return
+        if task is None:
+            return
+        func, args = task
+        try:
+            result = func(*args)
+        except MemoryError:
+            result = SandboxFailure("ran out of memory")
+        except ENVIRONMENT_ERRORS as e:
+            result = SandboxFailure(f"raised {e!r}", fatal=True)
+        except Exception as e:
+            result = SandboxFailure(f"raised {e!r}")
+        try:
+            connection.send(result)
+        except Exception as e:
+            connection.send(SandboxFailure(f"returned an unpicklable result: {e!r}"))
+
+
+class SandboxWorker:
+    """
+    A worker process and the connection used to send it tasks
+    """
+    def __init__(self, context, initializer, initargs, memory_limit):
+        self.connection, child_connection = context.Pipe()
+        self.process = context.Process(
+            target=_worker_loop,
+            args=(child_connection, initializer, initargs, memory_limit),
+            daemon=True)
+        self.process.start()
+        child_connection.close()
+        self.started = False
+        self.tasks_done = 0
+        self.task_index = None
+        self.deadline = None
+
+    def stop(self, kill: bool = False) -> None:
+        """
+        Stops the process, killing it if it may be stuck
+        """
+        if kill:
+            self.process.kill()
+        else:
+            try:
+                self.connection.send(None)
+            except OSError:
+                self.process.kill()
+        self.process.join()
+        self.connection.close()
+
+
+class SandboxExecutor:
+    """
+    Runs every task in a pool of worker processes with a wall-clock timeout and a memory limit.
+    A task that raises, times out, runs out of memory or crashes its worker returns a
+    SandboxFailure instead of taking down the caller, and the worker is replaced. Workers are
+    also recycled after max_tasks tasks to release any memory that leaked.
+
+    A worker that exits or fails before it has started, e.g. because its initializer raised or
+    the main module can't be imported without running, would fail every task the same way. Its
+    failure is fatal, and every task that hasn't finished gets it without starting more workers
+    """
+    # Seconds a worker has to start in, including importing the libraries in its initializer
+    STARTUP_TIMEOUT = 120
+
+    def __init__(self, workers: int = 1, timeout: float | None = None,
+                 memory_limit: int | None = None, max_tasks: int = 500,
+                 initializer=None, initargs: tuple = ()):
+        self.worker_count = max(1, workers)
+        self.timeout = timeout
+        self.memory_limit = memory_limit
+        self.max_tasks = max_tasks
+        self.initializer = initializer
+        self.initargs = initargs
+        # Workers are started from a fork server, or spawned where there is none, instead of
+        # being forked from the caller, which may be running threads that hold locks
+        if "forkserver" in multiprocessing.get_all_start_methods():
+            self.context = multiprocessing.get_context("forkserver")
+        else:
+            self.context = multiprocessing.get_context("spawn")
+        self.workers: list[SandboxWorker] = []
+
+    def _start_worker(self) -> SandboxWorker:
+        worker = SandboxWorker(self.context, self.initializer, self.initargs, self.memory_limit)
+        # Until the worker has started, its deadline is the time it has to start in
+        worker.deadline = time.monotonic() + self.STARTUP_TIMEOUT
+        return worker
+
+    def map(self, func, *iterables) -> list:
+        """
+        Runs func over the arguments and returns the results in order. A task's timeout starts
+        once its worker has started, so that starting a worker isn't counted against it
+        """
+        tasks = list(zip(*iterables))
+        results = [None] * len(tasks)
+        next_task = 0
+        while len(self.workers) < min(self.worker_count, len(tasks)):
+            self.workers.append(self._start_worker())
+
+        running = 0
+        while next_task < len(tasks) or running:
+            for i, worker in enumerate(self.workers):
+                if worker.task_index is None and next_task < len(tasks):
+                    if worker.tasks_done >= self.max_tasks:
+                        worker.stop()
+                        worker = self.workers[i] = self._start_worker()
+                    worker.connection.send((func, tasks[next_task]))
+                    worker.task_index = next_task
+                    if worker.started:
+                        worker.deadline = self._get_task_deadline()
+                    next_task += 1
+                    running += 1
+
+            busy = [worker for worker in self.workers if worker.task_index is not None]
+            deadlines = [worker.deadline for worker in busy if worker.deadline is not None]
+            wait_timeout = None
+            if deadlines:
+                wait_timeout = max(0, min(deadlines) - time.monotonic())
+            ready = multiprocessing.connection.wait(
+                [worker.connection for worker in busy], wait_timeout)
+
+            for i, worker in enumerate(self.workers):
+                if worker.task_index is None:
+                    continue
+                if worker.connection in ready:
+                    try:
+                        result = worker.connection.recv()
+                    except (EOFError, OSError):
+                        worker.process.join(1)
+                        if not worker.started:
+                            return self._fail_startup(results, SandboxFailure(
+                                f"couldn't start its worker, which exited with code "
+                                f"{worker.process.exitcode}", fatal=True))
+                        result = SandboxFailure(
+                            f"crashed its worker with exit code {worker.process.exitcode}")
+                        failed = True
+                    else:
+                        if isinstance(result, _WorkerStarted):
+                            worker.started = True
+                            worker.deadline = self._get_task_deadline()
+                            continue
+                        if not worker.started:
+                            return self._fail_startup(results, result)
+                        worker.tasks_done += 1
+                        failed = False
+                    results[worker.task_index] = result
+                elif worker.deadline is not None and time.monotonic() >= worker.deadline:
+                    if not worker.started:
+                        return self._fail_startup(results, SandboxFailure(
+                            f"couldn't start its worker within {self.STARTUP_TIMEOUT}s",
+                            fatal=True))
+                    results[worker.task_index] = SandboxFailure(
+                        f"timed out after {self.timeout}s")
+                    failed = True
+                else:
+                    continue
+
+                worker.task_index = None
+                worker.deadline = None
+                running -= 1
+                if failed:
+                    worker.stop(kill=True)
+                    self.workers[i] = self._start_worker()
+        return results
+
+    def _get_task_deadline(self) -> float | None:
+        if self.timeout is None:
+            return None
+        return time.monotonic() + self.timeout
+
+    def _fail_startup(self, results: list, failure: SandboxFailure) -> list:
+        """
+        Gives the failure of a worker that couldn't start to every task without a result, and
+        stops the workers
+        """
+        for worker in self.workers:
+            worker.stop(kill=True)
+        self.workers = []
+        return [failure if result is None else result for result in results]
+
+    def shutdown(self) -> None:
+        """
+        Stops all worker processes
+        """
+        for worker in self.workers:
+            worker.stop()
+        self.workers = []
@@ -0,0 +1,80 @@
+"""
+Helper for finding byte-identical files with as little I/O as possible
+"""
+import hashlib
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+PARTIAL_SIZE = 64 * 1024
+READ_SIZE = 1024 * 1024
+
+
+def _new_hasher():
+    if xxhash is not None:
+        return xxhash.xxh3_128()
+    return hashlib.blake2b(digest_size=16)
+
+
+class StagedHashHelper:
+    """
+    Assigns every file a content key that is equal for byte-identical files, in stages:
+        1. group by size, a file with a unique size can't have an identical copy
+        2. hash the first and last PARTIAL_SIZE bytes of files that share a size
+        3. hash the whole file only when the partial hashes also collide
+    """
+    def __init__(self, partial_size: int = PARTIAL_SIZE):
+        self.partial_size = partial_size
+
+    def get_content_keys(self, sizes: dict[str, int]) -> dict[str, str]:
+        """
+        Returns a dictionary of path to content key for the given path to file size dictionary
+        """
+        keys = {}
+        for size, paths in self._group(sizes.items()).items():
+            if len(paths) == 1:
+                keys[paths[0]] = f"size:{size}"
+                continue
+
+            partial_hashes = {path: self.hash_partial(path, size) for path in paths}
+            for partial_hash, partial_paths in self._group(partial_hashes.items()).items():
+                if len(partial_paths) == 1 or size <= 2 * self.partial_size:
+                    # The partial hash already covers the whole of a small file
+                    for path in partial_paths:
+                        keys[path] = f"partial:{size}:{partial_hash}"
+                    continue
+                for path in partial_paths:
+                    keys[path] = f"full:{size}:{self.hash_full(path)}"
+        return keys
+
+    @staticmethod
+    def _group(items) -> dict:
+        groups = {}
+        for path, value in items:
+            groups.setdefault(value, []).append(path)
+        return groups
+
+    def hash_partial(self, path: str, size: int) -> str:
+        """
+        Hashes the first and last partial_size bytes of the file
+        """
+        hasher = _new_hasher()
+        with open(path, "rb") as f:
+            hasher.update(f.read(self.partial_size))
+            if size > self.partial_size:
+                f.seek(max(self.partial_size, size - self.partial_size))
+                hasher.update(f.read(self.partial_size))
+        return hasher.hexdigest()
+
+    @staticmethod
+    def hash_full(path: str) -> str:
+        """
+        Hashes the whole file
+        """
+        hasher = _new_hasher()
+        with open(path, "rb") as f:
+            while chunk := f.read(READ_SIZE):
+                hasher.update(chunk)
+        return hasher.hexdigest()
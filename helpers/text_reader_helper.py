@@ -1,111 +1,178 @@
 """
 Helper for reading text files
 """
+import functools
+import inspect
 import typing
-import extract_msg
-import openpyxl
-import xlrd
 
-import html2text
-import pdfplumber
-from docx import Document
+# Every reader imports its library the first time it is used, so that runs without a given
+# document type never pay for importing its library
+
+TXT_CHUNK_SIZE = 1024 * 1024
 
 def error_handler(func):
     """
-    Decorator to wrap file readers in a try/catch
+    Decorator to wrap file readers in a try/catch. Generator readers are wrapped while they
+    are being iterated
     """
+    def handle(e: Exception):
+        if isinstance(e, FileNotFoundError):
+            raise FileNotFoundError(f'Failed to read file in given path: {e}')
+        raise RuntimeError(f'Unexpected Error occured: {e}')
+
+    if inspect.isgeneratorfunction(func):
+        @functools.wraps(func)
+        def generator_wrapper(*args, **kwargs):
+            try:
+                yield from func(*args, **kwargs)
+            except Exception as e:
+                handle(e)
+        return generator_wrapper
+
     def wrapper(*args, **kwargs):
         try:
             return func(*args, **kwargs)
-        except FileNotFoundError as e:
-            raise FileNotFoundError(f'Failed to read file in given path: {e}')
         except Exception as e:
-            raise RuntimeError(f'Unexpected Error occured: {e}')
+            handle(e)
     return wrapper
 
 class TextReaderHelper:
     """
     Helper for reading text Files
+
+    The iter_ readers yield a document in chunks, page by page or row by row, so that memory
+    use doesn't grow with the size of the document
     """
-    def read_file(self, path, extension) -> str:
+    def __init__(self, max_pages: int | None = None, max_chars: int | None = None):
+        """
+        max_pages - maximum number of pdf pages read per file
+        max_chars - maximum number of characters read per file
+        """
+        self.max_pages = max_pages
+        self.max_chars = max_chars
+
+    def iter_file(self, path, extension) -> typing.Iterator[str]:
         """
-        Helper method for reading files and returns the stringified value of its contents
+        Yields the contents of the file in chunks, up to max_chars characters
         """
         if (extension == "doc" or extension == "docx"):
-            return self.read_doc(path)
+            chunks = self.iter_doc(path)
         elif (extension == "xls" or extension == "xlsx"):
-            return self.read_xls(path, extension)
+            chunks = self.iter_xls(path, extension)
         elif extension == "msg":
-            return self.read_msg(path)
+            chunks = iter([self.read_msg(path)])
         elif extension == "pdf":
-            return self.read_pdf(path)
+            chunks = self.iter_pdf(path)
         elif extension == "txt":
-            return self.read_txt(path)
+            chunks = self.iter_txt(path)
         elif extension == "html":
-            return self.read_html(path)
+            chunks = iter([self.read_html(path)])
         else:
             raise RuntimeError(f"Unexpected extension received: {extension}")
 
+        if self.max_chars is None:
+            yield from chunks
+            return
+        remaining = self.max_chars
+        for chunk in chunks:
+            if len(chunk) >= remaining:
+                yield chunk[:remaining]
+                return
+            remaining -= len(chunk)
+            yield chunk
+
     @error_handler
     def read_html(self, path):
         """
         Reads a html file
         """
+        import html2text
+
         with open(path, "r", encoding="utf-8") as f:
             html_content = f.read()
 
         return html2text.html2text(html_content)
 
     @error_handler
-    def read_txt(self, path):
+    def iter_txt(self, path):
         """
-        Reads a txt file
+        Reads a txt file in chunks
         """
         with open(path, "r", encoding="utf-8") as f:
-            return f.read()
+            while chunk := f.read(TXT_CHUNK_SIZE):
+                yield chunk
 
     @error_handler
-    def read_pdf(self, path):
+    def iter_pdf(self, path):
         """
-        Reads pdf files
+        Reads pdf files page by page, up to max_pages pages. Every page's parsed objects are
+        released once its text has been extracted
         """
-        text = ""
+        import pdfplumber
+
         with pdfplumber.open(path) as pdf:
-            for page in pdf.pages:
-                text += page.extract_text() or ""
-        return text
+            for i, page in enumerate(pdf.pages):
+                if self.max_pages is not None and i >= self.max_pages:
+                    break
+                yield page.extract_text() or ""
+                if hasattr(page, "close"):
+                    page.close()
 
     @error_handler
-    def read_doc(self, path):
+    def iter_doc(self, path):
         """
-        Reads legacy microsoft word documents
+        Reads legacy microsoft word documents paragraph by paragraph
         """
+        from docx import Document
+
         doc = Document(path)
-        return "\n".join([p.text for p in doc.paragraphs])
+        for i, paragraph in enumerate(doc.paragraphs):
+            if i:
+                yield "\n"
+            yield paragraph.text
 
     @error_handler
     def read_msg(self, path):
         """
         Reads a msg file - likely a file export of Microsoft Outlook saved emails
         """
+        import extract_msg
+
         msg = extract_msg.Message(path)
         return msg.body or ""
 
     @error_handler
-    def read_xls(self, path, extension):
+    def iter_xls(self, path, extension):
         """
-        Reads an excel file as a text file to hash downstream
+        Reads an excel file row by row. xlsx workbooks are opened read-only so that rows are
+        streamed from the file, and xls sheets are loaded and released one at a time
         """
-        text = []
+        first_row = True
         if extension == "xlsx":
-            workbook = openpyxl.load_workbook(path, data_only=True)
-            sheets = workbook.worksheets
-            for sheet in sheets:
-                for row in sheet.iter_rows(values_only=True):
-                    text.append(" ".join([str(cell) if cell is not None else "" for cell in row]))
+            import openpyxl
+
+            workbook = openpyxl.load_workbook(path, read_only=True, data_only=True)
+            try:
+                for sheet in workbook.worksheets:
+                    for row in sheet.iter_rows(values_only=True):
+                        if not first_row:
+                            yield "\n"
+                        first_row = False
+                        yield " ".join([str(cell) if cell is not None else "" for cell in row])
+            finally:
+                workbook.close()
         else:
-            workbook = xlrd.open_workbook(path)
-            for sheet in workbook.sheets():
-                for row_idx in range(sheet.nrows):
-                    text.append(" ".join([str(cell) for cell in sheet.row_values(row_idx)]))
-        return "\n".join(text)
+            import xlrd
+
+            workbook = xlrd.open_workbook(path, on_demand=True)
+            try:
+                for sheet_index in range(workbook.nsheets):
+                    sheet = workbook.sheet_by_index(sheet_index)
+                    for row_idx in range(sheet.nrows):
+                        if not first_row:
+                            yield "\n"
+                        first_row = False
+                        yield " ".join([str(cell) for cell in sheet.row_values(row_idx)])
+                    workbook.unload_sheet(sheet_index)
+            finally:
+                workbook.release_resources()
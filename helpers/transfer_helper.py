@@ -0,0 +1,144 @@
+"""
+Helper for moving files, including across filesystems
+"""
+import errno
+import fcntl
+import hashlib
+import os
+import shutil
+import threading
+import time
+
+# ioctl request for cloning a file's extents (reflink) on btrfs, XFS and other CoW filesystems
+FICLONE = 0x40049409
+BUFFER_SIZE = 8 * 1024 * 1024
+
+
+class TransferHelper:
+    """
+    Moves files without ever overwriting an existing file. Moves within a filesystem are a
+    rename. Moves across filesystems are a copy, verify and unlink, where the copy uses the
+    cheapest method available: a reflink, copy_file_range, sendfile, and finally a plain copy
+    with large buffers. Copies are written to a temporary name first, so a destination never
+    holds a partial file
+
+    verify - "size" compares the sizes of the copy and the source, "hash" also compares hashes
+    of their contents
+    """
+    def __init__(self, verify: str = "size"):
+        self.verify = verify
+        self.lock = threading.Lock()
+        self.devices: dict[str, int] = {}
+        self.files_moved = 0
+        self.files_copied = 0
+        self.bytes_copied = 0
+        self.copy_seconds = 0.0
+
+    def move(self, source: str, destination: str) -> None:
+        """
+        Moves source to destination, raising FileExistsError if the destination exists
+        """
+        if os.path.exists(destination):
+            raise FileExistsError(f"Destination already exists: {destination}")
+
+        source_stat = os.stat(source)
+        if source_stat.st_dev == self._get_device(os.path.dirname(destination)):
+            try:
+                os.rename(source, destination)
+                with self.lock:
+                    self.files_moved += 1
+                return
+            except OSError as e:
+                if e.errno != errno.EXDEV:
+                    raise
+        self._copy_and_unlink(source, destination, source_stat)
+
+    def _get_device(self, directory: str) -> int:
+        device = self.devices.get(directory)
+        if device is None:
+            device = os.stat(directory).st_dev
+            with self.lock:
+                self.devices[directory] = device
+        return device
+
+    def _copy_and_unlink(self, source: str, destination: str,
+                         source_stat: os.stat_result) -> None:
+        temp_path = f"{destination}.partial-{os.getpid()}-{threading.get_ident()}"
+        start = time.perf_counter()
+        try:
+            with open(source, "rb") as source_file, open(temp_path, "xb") as temp_file:
+                self._copy_contents(source_file, temp_file, source_stat.st_size)
+                temp_file.flush()
+                os.fsync(temp_file.fileno())
+            shutil.copystat(source, temp_path)
+            self._verify(source, temp_path, source_stat)
+            if os.path.exists(destination):
+                raise FileExistsError(f"Destination already exists: {destination}")
+            os.rename(temp_path, destination)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        os.remove(source)
+
+        with self.lock:
+            self.files_copied += 1
+            self.bytes_copied += source_stat.st_size
+            self.copy_seconds += time.perf_counter() - start
+
+    @staticmethod
+    def _copy_contents(source_file, temp_file, size: int) -> None:
+        source_fd = source_file.fileno()
+        temp_fd = temp_file.fileno()
+        try:
+            fcntl.ioctl(temp_fd, FICLONE, source_fd)
+            return
+        except OSError:
+            pass
+
+        copied = 0
+        for copy_range in (getattr(os, "copy_file_range", None), getattr(os, "sendfile", None)):
+            if copy_range is None:
+                continue
+            try:
+                while copied < size:
+                    if copy_range is os.sendfile:
+                        sent = os.sendfile(temp_fd, source_fd, copied, BUFFER_SIZE)
+                    else:
+                        sent = os.copy_file_range(source_fd, temp_fd, BUFFER_SIZE, copied,
+                                                  copied)
+                    if sent == 0:
+                        break
+                    copied += sent
+                return
+            except OSError as e:
+                if copied or e.errno not in (errno.EXDEV, errno.ENOSYS, errno.EINVAL,
+                                             errno.EOPNOTSUPP, errno.ENOTSUP):
+                    raise
+
+        shutil.copyfileobj(source_file, temp_file, BUFFER_SIZE)
+
+    def _verify(self, source: str, copy: str, source_stat: os.stat_result) -> None:
+        if os.stat(copy).st_size != source_stat.st_size:
+            raise OSError(f"Copy of {source} has the wrong size")
+        if self.verify == "hash" and self._hash(source) != self._hash(copy):
+            raise OSError(f"Copy of {source} does not match the source")
+
+    @staticmethod
+    def _hash(path: str) -> str:
+        hasher = hashlib.blake2b()
+        with open(path, "rb") as f:
+            while chunk := f.read(BUFFER_SIZE):
+                hasher.update(chunk)
+        return hasher.hexdigest()
+
+    def get_report(self) -> str:
+        """
+        Returns a summary of the moves and the copy throughput
+        """
+        report = f"{self.files_moved} files renamed, {self.files_copied} files copied"
+        if self.files_copied:
+            megabytes = self.bytes_copied / 1024 ** 2
+            report += (f" ({megabytes:.1f} MB in {self.copy_seconds:.1f}s, "
+                       f"{megabytes / max(self.copy_seconds, 1e-9):.1f} MB/s per thread)")
+        return report
@@ -0,0 +1,108 @@
+"""
+Helper for grabbing keyframes from videos quickly
+"""
+import functools
+import io
+import re
+import shutil
+import subprocess
+import typing
+
+if typing.TYPE_CHECKING:
+    import PIL.Image
+
+
+class VideoFrameHelper:
+    """
+    Grabs frames from videos by seeking ffmpeg straight to the keyframe nearest to each position
+    and decoding keyframes only, so that no frames in between are decoded. Every decode is
+    bounded by a timeout so that damaged videos fail quickly instead of hanging
+    """
+    def __init__(self, timeout: float = 10):
+        self.timeout = timeout
+
+    @staticmethod
+    @functools.cache
+    def is_available() -> bool:
+        """
+        Returns True if ffmpeg is installed. Checked once per process
+        """
+        return shutil.which("ffmpeg") is not None
+
+    @staticmethod
+    def parse_duration(duration) -> float | None:
+        """
+        Parses exiftool's Duration tag, either `12.34 s` or `0:01:23`, into seconds
+        """
+        if isinstance(duration, (int, float)):
+            return float(duration)
+        if not isinstance(duration, str):
+            return None
+        match = re.match(r"^([\d.]+) s", duration)
+        if match:
+            return float(match.group(1))
+        match = re.match(r"^(\d+):(\d+):([\d.]+)", duration)
+        if match:
+            hours, minutes, seconds = match.groups()
+            return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+        return None
+
+    @staticmethod
+    def get_positions(duration: float | None, count: int) -> list[float]:
+        """
+        Returns count positions spread evenly through the middle of the video, in seconds.
+        A single position is the middle of the video, or its start when the duration is
+        unknown. Several positions can't be spread without the duration
+        """
+        if not duration:
+            if count > 1:
+                raise RuntimeError(f"Unable to spread {count} keyframes through a video of "
+                                   f"unknown duration")
+            return [0.0]
+        return [duration * (i + 1) / (count + 1) for i in range(count)]
+
+    def probe_duration(self, path: str) -> float | None:
+        """
+        Reads the duration of the video with ffprobe, for videos whose metadata has none
+        """
+        command = ["ffprobe", "-v", "error", "-show_entries", "format=duration",
+                   "-of", "default=noprint_wrappers=1:nokey=1", path]
+        try:
+            result = subprocess.run(command, capture_output=True, text=True,
+                                    timeout=self.timeout, check=False)
+            return float(result.stdout.strip())
+        except (OSError, subprocess.TimeoutExpired, ValueError):
+            return None
+
+    def extract_keyframe(self, path: str, position: float) -> "PIL.Image.Image":
+        """
+        Returns the first keyframe at or after the keyframe nearest to position
+        """
+        import PIL.Image
+
+        command = ["ffmpeg", "-nostdin", "-v", "error", "-skip_frame", "nokey",
+                   "-noaccurate_seek", "-ss", f"{position:.3f}", "-i", path,
+                   "-frames:v", "1", "-f", "image2pipe", "-vcodec", "png", "-"]
+        try:
+            result = subprocess.run(command, capture_output=True, timeout=self.timeout,
+                                    check=False)
+        except subprocess.TimeoutExpired as e:
+            raise RuntimeError(f"Timed out decoding video file. Path: {path}") from e
+        if result.returncode != 0 or not result.stdout:
+            raise RuntimeError(f"Unable to grab frame from video file. Path: {path}")
+        with PIL.Image.open(io.BytesIO(result.stdout)) as image:
+            return image.convert("RGB")
+
+    def extract_keyframes(self, path: str, duration: float | None,
+                          count: int = 1) -> list["PIL.Image.Image"]:
+        """
+        Returns count keyframes spread through the video. Without a duration, it is probed
+        with ffprobe
+        """
+        if not duration and count > 1:
+            duration = self.probe_duration(path)
+        try:
+            positions = self.get_positions(duration, count)
+        except RuntimeError as e:
+            raise RuntimeError(f"{e}. Path: {path}") from e
+        return [self.extract_keyframe(path, position) for position in positions]
@@ -0,0 +1,38 @@
+"""
+Helper for walking large directory trees without recursion
+"""
+import os
+from typing import Callable, Iterator
+
+
+def walk_files(root_path: str, batch_size: int = 1000,
+               skip_files: Callable[[str], bool] | None = None
+               ) -> Iterator[tuple[str, list[os.DirEntry], bool]]:
+    """
+    Walks the tree under root_path iteratively and lazily yields (directory, file entries,
+    is_last_batch) tuples, with at most batch_size entries per batch. A directory's files are
+    yielded before its subdirectories are walked, and every directory ends with a batch whose
+    is_last_batch is True, even if that batch is empty.
+
+    The DirEntry objects are yielded as is so that their cached stat() results can be reused.
+    The files of directories for which skip_files returns True are not yielded, but their
+    subdirectories are still walked. Symlinked directories are not followed
+    """
+    directories = [root_path]
+    while directories:
+        directory = directories.pop()
+        skip = skip_files is not None and skip_files(directory)
+        subdirectories = []
+        batch = []
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirectories.append(entry.path)
+                elif not skip and entry.is_file():
+                    batch.append(entry)
+                    if len(batch) >= batch_size:
+                        yield directory, batch, False
+                        batch = []
+        # Reversed so that subdirectories are walked in the order scandir listed them
+        directories.extend(reversed(subdirectories))
+        yield directory, batch, True
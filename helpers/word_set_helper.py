@@ -0,0 +1,42 @@
+"""
+Helper for loading the English dictionary used to filter extracted text
+"""
+import os
+import pickle
+
+WORD_SET_CACHE_PATH = os.path.join(os.path.expanduser("~"), ".cache", "recovery-dupe-cleaner",
+                                   "words.pickle")
+
+_word_set: frozenset[str] | None = None
+
+
+def get_word_set() -> frozenset[str]:
+    """
+    Returns the set of dictionary words, loaded on first use. The nltk words corpus is only read
+    once and then kept as a pickled frozenset, and nothing is ever downloaded
+    """
+    global _word_set
+    if _word_set is None:
+        try:
+            with open(WORD_SET_CACHE_PATH, "rb") as f:
+                _word_set = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            _word_set = _build_word_set()
+    return _word_set
+
+
+def _build_word_set() -> frozenset[str]:
+    from nltk.corpus import words
+
+    try:
+        word_set = frozenset(words.words())
+    except LookupError as e:
+        raise RuntimeError("The nltk words corpus is not installed. Install it once with "
+                           "`python -m nltk.downloader words`") from e
+
+    os.makedirs(os.path.dirname(WORD_SET_CACHE_PATH), exist_ok=True)
+    temp_path = f"{WORD_SET_CACHE_PATH}.{os.getpid()}.tmp"
+    with open(temp_path, "wb") as f:
+        pickle.dump(word_set, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(temp_path, WORD_SET_CACHE_PATH)
+    return word_set
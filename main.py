@@ -1,10 +1,29 @@
+import argparse
 import signal
 import os
-from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
 import sys
 from classes.file import File
 
-from classes.file import Other, Video, Image, Text
+from classes.file import (Image, Other, Text, Video, configure_file_classes, create_bad_file,
+                         create_file, get_file_class, initialize_worker)
+from helpers.cache_helper import CacheHelper, DEFAULT_CACHE_PATH
+from helpers.checkpoint_helper import CheckpointHelper
+from helpers.completed_index_helper import CompletedIndex
+from helpers.directory_helper import DirectoryHelper
+from helpers.library_index_helper import LibraryIndexHelper
+from helpers.metrics_helper import MetricsHelper, run_profiler
+from helpers.move_plan_helper import MovePlanHelper, PlannedMove
+from helpers.near_duplicate_helper import BKTree, SimhashIndex
+from helpers.phash_helper import PhashHelper
+from helpers.pipeline_helper import PipelineHelper
+from helpers.plan_file_helper import PlanFileHelper
+from helpers.sandbox_helper import SandboxExecutor, SandboxFailure
+from helpers.staged_hash_helper import StagedHashHelper
+from helpers.transfer_helper import TransferHelper
+from helpers.walker_helper import walk_files
+from helpers.exiftool_helper import ExiftoolHelper
+from helpers.group_helper import GroupHelper
 
 
 class DupeCleaner:
@@ -45,25 +64,105 @@ class DupeCleaner:
         "Texts": text,
         "Others": other
     }
-    date_directories: dict[str, dict[str, dict[str, list[str]]]] = {
-        "Images": {},
-        # "Videos": {},
-        "Texts": {},
-        "Others": {}
-    }
     state = {
         "state": "",
         "files": files,
-        "date_directories": date_directories,
-        "completed_directories": [],
-        "completed_files": []
+        "completed": CompletedIndex(),
+        "completed_moves": {}
     }
 
-    def __init__(self, root_path:str) -> None:
+    STAGED_BATCH_SIZE = 1000
+    WALK_BATCH_SIZE = 1000
+
+    def __init__(self, root_path:str, workers: int = 1, cache: CacheHelper | None = None,
+                 checkpoint: CheckpointHelper | None = None, image_threshold: int = 0,
+                 text_threshold: int = 0, staged: bool = False, perceptual: bool = False,
+                 file_settings: dict[str, dict] | None = None, move_workers: int = 1,
+                 plan_path: str | None = None, transfer: TransferHelper | None = None,
+                 file_timeout: float | None = None, file_memory_limit: int | None = None,
+                 metrics: MetricsHelper | None = None, verbose: bool = False,
+                 batch_phash: bool = False, pipeline: bool = False,
+                 metadata_concurrency: int = 2,
+                 library: LibraryIndexHelper | None = None) -> None:
         """
         ToDo: Check if root_path ends with '/'
+
+        workers - number of processes used to build and hash files during pre-processing
+        cache - store of previously computed metadata and hashes, skipped if None
+        checkpoint - store the run's progress is saved to and resumed from, skipped if None
+        image_threshold - maximum number of differing perceptual hash bits for images to be
+            grouped as near-duplicates, 0 only groups identical hashes
+        text_threshold - maximum number of differing Simhash bits for texts to be grouped as
+            near-duplicates, 0 only groups identical hashes
+        staged - find byte-identical files by size and partial hashes before any other hashing
+        perceptual - in staged mode, also hash the files perceptually after the content stages
+        file_settings - class level settings of the File classes, see configure_file_classes
+        move_workers - number of threads moving files into different directories in parallel
+        plan_path - if given, the sort plan is written to this path instead of sorting
+        transfer - moves files, copying them when the destination is on another filesystem
+        file_timeout - seconds allowed for building each file before it is marked as a bad file
+        file_memory_limit - bytes of memory allowed for building each file before it is marked as
+            a bad file
+        metrics - records the time spent in every stage and prints progress
+        verbose - print every directory as it is pre-processed, and the number of empty
+            directories removed
+        batch_phash - without sandboxed workers, hash the images of every batch in one
+            vectorized pass
+        pipeline - pre-process the tree as a pipeline of overlapping stages, see PipelineHelper
+        metadata_concurrency - in pipeline mode, number of batches fetching metadata at once
+        library - index of a sorted library to ingest the files into, see load_library
+        With more than one worker, or with a timeout or memory limit, files are built in
+        sandboxed worker processes that are replaced when a file hangs or crashes them
         """
+        if library is not None and plan_path is not None:
+            raise ValueError("Plans don't record library index updates, so a library can't be "
+                             "ingested into through a plan")
         self.root_path = root_path
+        self.library = library
+        self.library_paths: set[str] = set()
+        # Files are sorted into the library instead of the root path when ingesting
+        self.destination_root = (os.path.join(library.library_root, "") if library is not None
+                                 else root_path)
+        self.cache = cache
+        self.checkpoint = checkpoint
+        self.staged = staged
+        self.move_workers = move_workers
+        self.plan_path = plan_path
+        self.transfer = transfer or TransferHelper()
+        # Replacing library originals moves files out of the library too
+        self.directories = DirectoryHelper(
+            root_path, *([library.library_root] if library is not None else []))
+        self.metrics = metrics or MetricsHelper()
+        self.verbose = verbose
+        self.batch_phash = batch_phash
+        self.pipeline = pipeline
+        self.metadata_concurrency = metadata_concurrency
+        # Files marked as bad after a sandbox failure, which are never cached
+        self.sandbox_failures: set[str] = set()
+        self.perceptual = perceptual or not staged
+        self.groups = {file_type: GroupHelper() for file_type in self.files}
+        self.near_duplicate_indexes = {}
+        if not self.perceptual:
+            # Content keys have no notion of distance
+            image_threshold = text_threshold = 0
+        if image_threshold > 0:
+            self.near_duplicate_indexes["Images"] = (BKTree(), image_threshold)
+        if text_threshold > 0:
+            self.near_duplicate_indexes["Texts"] = (SimhashIndex(text_threshold),
+                                                    text_threshold)
+        self.exiftool = ExiftoolHelper(workers=workers)
+        file_settings = file_settings or {}
+        configure_file_classes(file_settings)
+        if checkpoint is not None:
+            checkpoint.settings = self.get_checkpoint_settings()
+        self.executor = None
+        if workers > 1 or file_timeout is not None or file_memory_limit is not None:
+            self.executor = SandboxExecutor(workers=workers, timeout=file_timeout,
+                                            memory_limit=file_memory_limit,
+                                            initializer=initialize_worker,
+                                            initargs=(file_settings,))
+        if library is not None:
+            self.load_library()
 
     def next(self):
         """
@@ -72,9 +171,15 @@ class DupeCleaner:
         and continue where it previously left off
         """
         status = self.state["state"]
-        if status == "":
+        if status in ("", "Preprocessing"):
             print("preprocessing...")
             self.pre_process()
+        if status == "Prepare Folders" and self.plan_path is not None:
+            print(f"Writing plan to {self.plan_path}...")
+            self.export_plan(self.plan_path)
+            self.save()
+            self.close()
+            exit()
         if status == "Prepare Folders":
             print("preparing folders...")
             self.prepare_folders()
@@ -83,237 +188,735 @@ class DupeCleaner:
             self.sort()
         elif status == "Sort Complete":
             print("Done!")
-            self.remove_empty_folders(self.root_path)
+            self.remove_empty_folders()
+            self.close()
+            if self.checkpoint is not None:
+                self.checkpoint.clear()
             exit()
+        self.save()
+
+    def close(self) -> None:
+        """
+        Stops the exiftool processes and closes the cache
+        """
+        self.exiftool.close()
+        if self.cache is not None:
+            self.cache.close()
+        if self.library is not None:
+            self.library.close()
+
+    def export_plan(self, plan_path: str) -> None:
+        """
+        Writes the complete sort plan to plan_path without moving anything. Pre-processing stays
+        in the checkpoint, so a later run can sort or re-plan without rehashing, until the plan
+        is executed
+        """
+        moves = self.plan_sort()
+        PlanFileHelper.write(plan_path, self.root_path, moves,
+                             self.checkpoint.directory if self.checkpoint is not None else None)
+        groups = sum(len(file_dict) for file_dict in self.files.values())
+        print(f"Planned {len(moves)} moves in {groups} groups")
+
+    def save(self) -> None:
+        """
+        Commits the current progress to the checkpoint
+        """
+        if self.checkpoint is not None:
+            self.checkpoint.commit(self.state["state"])
+        if self.cache is not None:
+            self.cache.commit()
+
+    def get_checkpoint_settings(self) -> dict:
+        """
+        Returns the settings journaled files were hashed with. A checkpoint saved with other
+        settings can't be resumed
+        """
+        return {"staged": self.staged, "perceptual": self.perceptual,
+                "hash_versions": {file_class.__name__: file_class.get_hash_version()
+                                  for file_class in (Image, Video, Text)}}
+
+    def resume(self) -> None:
+        """
+        Restores the progress saved by a previous, interrupted run over the same root path by
+        replaying its journal. Files are rebuilt from their journaled records without rehashing
+        """
+        if self.checkpoint is None:
+            return
+        state, records = self.checkpoint.load()
+        for record in records:
+            if record["op"] == "file":
+                file_type, this_file = create_file(record["path"], cached=record["record"])
+                self._add_file(file_type, this_file)
+                self.state["completed"].complete_file(record["path"])
+            elif record["op"] == "directory":
+                self.state["completed"].complete_directory(record["path"])
+            elif record["op"] == "move":
+                self.state["completed_moves"][record["src"]] = record["dst"]
+        self.state["state"] = state
+        if records:
+            print(f"Resumed from checkpoint at state '{state}' with {len(records)} records")
 
     def pre_process(self):
         self.state["state"] = "Preprocessing"
-        self._recursively_preprocess_files(self.root_path)
+        self.metrics.start_progress("pre-process")
+        if self.staged:
+            self._staged_preprocess()
+        elif self.pipeline:
+            PipelineHelper(self, self.metadata_concurrency).run()
+        else:
+            self._preprocess_tree()
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+        if self.cache is not None:
+            self.cache.commit()
         self.state["state"] = "Prepare Folders"
         print("preprocess done")
 
     def prepare_folders(self):
         """
-        Prepares folders for the sorting process
+        Prepares the sorting process. Destination folders are no longer created up front, sort
+        creates each one the first time a file is moved into it
         """
-        for file_type, _ in self.files.items():
-            print(f"Directories are: {self.date_directories}")
-            print(f"Creating for {file_type}...")
-            if file_type != "Others":
-                self.create_directories(self.root_path + "Originals/", file_type)
-                self.create_directories(self.root_path + "Duplicates/", file_type)
-                self.create_directories(self.root_path + "Bad Files/", file_type)
-            else:
-                self.create_directories(self.root_path, file_type)
         self.state["state"] = "Begin Sorting"
 
     def sort(self):
         """
         Sorts out original files and duplicate files into folders based on their
-        Originals' modified dates
+        Originals' modified dates. All destinations are planned before any file is moved
         """
-        for file_type, file_dict in self.files.items():
-            for _, file in file_dict.items():
-                is_move_complete = False
-                next_name = 0
-                destination_path_name = file.get_destination_path_name()
-
-                # print(f"{hash_name}: {str(file)} - {[str(dupe) for dupe in file.duplicates]}")
-
-                while not is_move_complete:
-                    try:
-                        if file.is_bad():
-                            mid_term = "Bad Files/"
-                        elif file_type == "Others":
-                            mid_term = ""
-                        else:
-                            mid_term = "Originals/"
-                        originals_dest_path = "".join([self.root_path,
-                                                       mid_term,
-                                                       destination_path_name])
-                        file.move(originals_dest_path)
-                        is_move_complete = True
-                    except FileExistsError:
-                        if next_name < 0:
-                            next_name += 1
-                            name, ext = destination_path_name.split(".")
-                            destination_path_name = "".join([name, f"#{next_name}#.", ext])
-                        else:
-                            next_name += 1
-                            name, _, ext = destination_path_name.split("#")
-                            destination_path_name = "#".join([name, next_name, ext])
-                    except Exception as e:
-                        print(f"Failed to move file from {file.path} to {destination_path_name}")
-                        raise e
-
-                    # If there are no duplicates, nothing happens after the split
-                    name, ext = destination_path_name.split(".")
-                    for i, dupe in enumerate(file.duplicates):
-                        dupe: File
-
-                        if dupe.is_bad():
-                            mid_term = "Bad Files/"
-                        elif file_type == "Others":
-                            mid_term = ""
-                        else:
-                            mid_term = "Duplicates/"
-
-                        dupe_path_name = "".join([self.root_path, mid_term, name, f"-{i}.", ext])
-                        dupe.move(dupe_path_name)
-
+        moves = self.plan_sort()
+        self.execute_plan(moves)
+        self.update_library(moves)
+        print(self.transfer.get_report())
         self.state["state"] = "Sort Complete"
 
-    def add_date_directories(self, file_type, year, month, day) -> None:
+    def plan_sort(self) -> list[PlannedMove]:
         """
-        Iteratively creates a nested dictionary of all years, months and days that need 
-        to be created as directories
-        e.g.
-        date_directories["2021"] = {
-            "01": ["23" ,"24", "25"]
-        }
+        Plans the move of every file, resolving destination name collisions in memory.
+        Duplicates are named after their original's resolved name with a `-#` suffix.
+        Library originals that are still the original of their group stay where they are
         """
-        if self.date_directories[file_type].get(year) is None:
-            self.date_directories[file_type][year] = {}
-
-        if self.date_directories[file_type][year].get(month) is None:
-            self.date_directories[file_type][year][month] = [day]
-        else:
-            if day not in self.date_directories[file_type][year][month]:
-                self.date_directories[file_type][year][month].append(day)
-
-    def create_directories(self, parent_path, file_type) -> None:
+        self.select_originals()
+        planner = MovePlanHelper()
+        moves = []
+        for file_type, file_dict in self.files.items():
+            for group, file in file_dict.items():
+                if file.is_bad():
+                    mid_term = "Bad Files/"
+                elif file_type == "Others":
+                    mid_term = ""
+                else:
+                    mid_term = "Originals/"
+                if file.path in self.library_paths:
+                    destination = file.path
+                    planner.claim(destination)
+                else:
+                    destination = self._plan_destination(
+                        planner, file, "".join([self.destination_root, mid_term,
+                                                file.get_destination_path_name()]))
+                    moves.append(PlannedMove(file, destination,
+                                             mid_term.rstrip("/") or "Others", file_type, group))
+
+                # If there are no duplicates, the name is never used
+                name, ext = os.path.splitext(
+                    os.path.relpath(destination, self.destination_root + mid_term))
+                for i, dupe in enumerate(file.duplicates):
+                    dupe: File
+
+                    if dupe.is_bad():
+                        mid_term = "Bad Files/"
+                    elif file_type == "Others":
+                        mid_term = ""
+                    else:
+                        mid_term = "Duplicates/"
+
+                    dupe_destination = self._plan_destination(
+                        planner, dupe,
+                        "".join([self.destination_root, mid_term, name, f"-{i}", ext]))
+                    moves.append(PlannedMove(dupe, dupe_destination,
+                                             mid_term.rstrip("/") or "Others", file_type, group))
+        return moves
+
+    def select_originals(self) -> None:
         """
-        Iterates through the pre-processed date_directories and builds directories for every
-        given date
+        Picks the original of every group in one pass and fills the dictionary of all files
+        with them, keyed by the hash of their group's first file
         """
-        for year, month_dict in self.date_directories[file_type].items():
-            for month, day_list in month_dict.items():
-                for day in day_list:
-                    path = Path("/".join([parent_path, year, month, day]))
-                    print(f"Creating path {path}")
-                    path.mkdir(parents=True, exist_ok=True)
-
-    def _recursively_preprocess_files(self, path):
+        for file_type, groups in self.groups.items():
+            with self.metrics.timer("select", file_type, files=len(groups)):
+                originals = groups.get_originals()
+            self.files[file_type].clear()
+            self.files[file_type].update(originals)
+            if groups:
+                self.metrics.set_distribution(f"{file_type} group sizes",
+                                              groups.get_group_sizes())
+
+    def load_library(self) -> None:
         """
-        Recursively processes files within the current path
-
-        Base case 1 - when this directory has been pre-processed before in the save state, 
-            skip it entirely
-            TODO: determine if Base case 1 can be deleted
-        Base case 2 - when this directory has no folders
+        Adds the originals of the library index to the groups before anything is pre-processed,
+        rebuilt from their indexed hashes without reading them. New files are then grouped with
+        them exactly, or as near-duplicates, like with any other file. Originals hashed with
+        another hash version can't be compared and are skipped, and originals that no longer
+        exist are dropped from the index
+        """
+        versions = {file_class.__name__: file_class.get_hash_version()
+                    for file_class in (Image, Video, Text)}
+        missing = 0
+        with self.metrics.timer("library", "All"):
+            for file_type, path, record in self.library.iter_originals(versions):
+                if not os.path.exists(path):
+                    self.library.remove(path)
+                    missing += 1
+                    continue
+                self._add_file(file_type, create_file(path, cached=record)[1])
+                self.library_paths.add(path)
+        self.library.commit()
+        print(f"Loaded {len(self.library_paths)} originals from the library index")
+        if missing:
+            print(f"Dropped {missing} originals that no longer exist from the library index")
+        stale = self.library.count_stale(versions)
+        if stale:
+            print(f"Skipped {stale} library originals hashed with another hash version")
+
+    def update_library(self, moves: list[PlannedMove]) -> None:
+        """
+        Records the new originals of a sort in the library index, and removes the library
+        originals that were replaced by a better copy and moved to the duplicates
+        """
+        if self.library is None:
+            return
+        for move in moves:
+            if move.source in self.library_paths:
+                self.library.remove(move.source)
+            if move.category == "Originals":
+                self.library.put(move.destination, move.file_type, move.file)
+        self.library.commit()
+
+    def _plan_destination(self, planner: MovePlanHelper, file: File, destination: str) -> str:
+        """
+        Reserves a destination for the file, keeping the destination of a move an interrupted
+        run already made
+        """
+        completed_destination = self.state["completed_moves"].get(file.path)
+        if (completed_destination is not None and not os.path.exists(file.path)
+                and os.path.exists(completed_destination)):
+            planner.claim(completed_destination)
+            return completed_destination
+        return planner.reserve(destination)
+
+    def execute_plan(self, moves: list[PlannedMove]) -> None:
+        """
+        Executes planned moves. Moves are grouped by destination directory, and with more than
+        one move worker, directories are handled in parallel
+        """
+        moves_by_directory: dict[str, list[PlannedMove]] = {}
+        for move in moves:
+            moves_by_directory.setdefault(os.path.dirname(move.destination), []).append(move)
+
+        self.metrics.start_progress("sort", len(moves))
+
+        def move_directory(directory_moves: list[PlannedMove]) -> None:
+            for move in directory_moves:
+                size = move.file.get_file_size()
+                try:
+                    with self.metrics.timer("move", move.file_type, size=size):
+                        self._move(move.file, move.destination)
+                except Exception as e:
+                    print(f"Failed to move file from {move.source} to {move.destination}")
+                    raise e
+                self.metrics.advance(1, size)
+
+        if self.move_workers <= 1:
+            for directory_moves in moves_by_directory.values():
+                move_directory(directory_moves)
+            return
+        with ThreadPoolExecutor(max_workers=self.move_workers) as executor:
+            for job in [executor.submit(move_directory, directory_moves)
+                        for directory_moves in moves_by_directory.values()]:
+                job.result()
 
-        case 3 - when this directory has folders, pre-process the folders first, 
-            then pre-process the files
-        case 4 - if the current file has been pre-processed, skip.
+    def _move(self, file: File, destination: str) -> None:
+        """
+        Moves the file unless a previous run already moved it. The move is journaled before it
+        is made so that an interrupted sort knows about it. The destination folder is created
+        on first use, and the source folder is recorded for the empty folder cleanup
         """
-        print(f"Running recursion for path:{path}")
-        # base case 1
-        if path in self.state["completed_directories"]:
+        source_directory = os.path.dirname(file.path)
+        completed_destination = self.state["completed_moves"].get(file.path)
+        if (completed_destination is not None and not os.path.exists(file.path)
+                and os.path.exists(completed_destination)):
+            file.path = completed_destination
+            self.directories.record_vacated(source_directory)
             return
 
-        directories = []
-        files = []
-        with os.scandir(path) as entries:
-            for entry in entries:
-                entry: os.DirEntry
-                if entry.is_file():
-                    files.append(entry.path)
-                if entry.is_dir():
-                    directories.append(entry.path)
-
-        # case 3 - handle all directories before handling base case
-        if directories:
-            for directory in directories:
-                self._recursively_preprocess_files(directory)
-
-        # base case 2
-        while len(files) > 0:
-            file: str = files[0]
-            # print(f"currently working on file {file}; files length is {len(files)}")
-            if "ds_store" in file.lower():
-                files.pop(0)
-            elif file not in self.state["completed_files"]:
-                file_type = "Others"
-                if file.endswith(Image.get_allowed_formats()):
-                    this_file = Image(file)
-                    file_type = "Images"
-                elif file.endswith(Video.get_allowed_formats()):
-                    this_file = Video(file)
-                    file_type = "Images"
-                elif file.endswith(Text.get_allowed_formats()):
-                    this_file = Text(file)
-                    file_type = "Texts"
-                else:
-                    this_file = Other(file)
+        if self.checkpoint is not None:
+            self.checkpoint.append({"op": "move", "src": file.path, "dst": destination},
+                                   flush=True)
+            self.checkpoint.maybe_commit(self.state["state"])
+        self.directories.ensure(os.path.dirname(destination))
+        file.move(destination, self.transfer)
+        self.directories.record_vacated(source_directory)
 
-                self.add_date_directories(
-                    file_type, this_file.date_time.year, this_file.date_time.month,
-                    this_file.date_time.day)
-                this_hash = this_file.get_hash()
-                other_file = self.files[file_type].get(this_hash)
+    def _preprocess_tree(self) -> None:
+        """
+        Streams the files under the root path to pre-processing in bounded batches.
 
-                if other_file:
-                    # handling for duplicates
-                    self.__compare(other_file, this_file)
-                else:
-                    # If other_file is None then there is no duplicates yet
-                    self.files[file_type][this_hash] = this_file
+        Directories that have been pre-processed before in the save state are not re-read,
+        and files that have been pre-processed before are skipped. A directory is marked as
+        completed once its last batch is done
+        """
+        completed = self.state["completed"]
+        for directory, entries, is_last_batch in self.metrics.iter_timed(
+                "scandir", "All",
+                walk_files(self.root_path, self.WALK_BATCH_SIZE, completed.is_directory_completed),
+                lambda batch: len(batch[1])):
+            if completed.is_directory_completed(directory):
+                continue
+            if self.verbose:
+                print(f"Pre-processing {len(entries)} files in {directory}")
+            pending_entries = {entry.path: entry for entry in entries
+                               if self._is_pending(entry.path)}
+            self._preprocess_paths(list(pending_entries), entries=pending_entries)
+
+            if is_last_batch:
+                self._complete_directory(directory)
+
+    def _is_pending(self, file: str) -> bool:
+        """
+        Returns True if the file still needs to be pre-processed
+        """
+        return ("ds_store" not in file.lower()
+                and not self.state["completed"].is_file_completed(file))
 
-                self.state["completed_files"].append(files.pop(0))
+    def _preprocess_paths(self, paths: list[str], hash_values: dict[str, str] | None = None,
+                          entries: dict[str, os.DirEntry] | None = None,
+                          records: dict[str, dict] | None = None) -> dict[str, File]:
+        """
+        Builds, hashes and adds the Files for the given paths and returns them by path.
+        When hash_values is given, those hashes are used instead of hashing the files. When
+        records is given, the Files are rebuilt from those cache records without reading them.
+        The stat results of any given directory entries are reused
+        """
+        stats, cached = {}, {}
+        if records is not None:
+            cached = records
+        elif hash_values is None:
+            stats, cached = self._lookup_cached(paths, entries)
+        metadata = self._fetch_metadata(paths, cached)
+        built = self._build_files(paths, metadata, cached, hash_values or {})
+        return self._index_files(paths, built, stats, cached)
+
+    def _lookup_cached(self, paths: list[str], entries: dict[str, os.DirEntry] | None = None
+                       ) -> tuple[dict[str, os.stat_result], dict[str, dict]]:
+        """
+        Returns the stat results of the paths and the cached records of those that have one
+        """
+        if self.cache is None:
+            return {}, {}
+        entries = entries or {}
+        stats = {file: entries[file].stat() if file in entries else os.stat(file)
+                 for file in paths}
+        versions = {}
+        for file in paths:
+            file_class = get_file_class(file)[1]
+            versions[file] = (file_class.__name__, file_class.get_hash_version())
+        return stats, self.cache.get_many(stats, versions)
+
+    def _fetch_metadata(self, paths: list[str], cached: dict[str, dict]) -> dict[str, dict]:
+        """
+        Fetches metadata for every path that isn't cached in as few exiftool round trips as
+        possible
+        """
+        uncached = [file for file in paths if file not in cached]
+        with self.metrics.timer("exiftool", "All", files=len(uncached)):
+            metadata = self.exiftool.get_metadata(uncached)
+        self.metrics.count("cached files", len(paths) - len(uncached))
+        return metadata
+
+    def _index_files(self, paths: list[str], built: list[tuple[str, File]],
+                     stats: dict[str, os.stat_result], cached: dict[str, dict]
+                     ) -> dict[str, File]:
+        """
+        Caches, groups and journals the built Files of the given paths and returns them by path.
+        Files marked as bad after a sandbox failure aren't cached, since a timeout or crash can
+        be transient, so a later run tries them again
+        """
+        built_files = {}
+        for file, (file_type, this_file) in zip(paths, built):
+            if file in self.sandbox_failures:
+                self.sandbox_failures.discard(file)
+            elif stats and file not in cached:
+                self.cache.put(this_file, stats[file])
+            size = this_file.get_file_size()
+            for stage, seconds in this_file.timings.items():
+                self.metrics.record(stage, file_type, seconds, size=size)
+            if this_file.is_bad():
+                self.metrics.count("bad files")
+            with self.metrics.timer("compare", file_type):
+                self._add_file(file_type, this_file)
+            self.state["completed"].complete_file(file)
+            if self.checkpoint is not None:
+                self.checkpoint.append(
+                    {"op": "file", "path": file, "record": this_file.get_cache_record()})
+            built_files[file] = this_file
+            self.metrics.advance(1, size)
+        return built_files
+
+    def _complete_directory(self, directory: str) -> None:
+        """
+        Marks a directory whose files have all been pre-processed as completed
+        """
+        # Marking the directory as completed also drops its files from the completed files
+        self.state["completed"].complete_directory(directory)
+        if self.checkpoint is not None:
+            self.checkpoint.append({"op": "directory", "path": directory})
+            self.checkpoint.maybe_commit(self.state["state"])
+
+    def _build_files(self, paths: list[str], metadata: dict[str, dict], cached: dict[str, dict],
+                     hash_values: dict[str, str]):
+        """
+        Builds and hashes the File objects for the given paths, in the given order. Files that
+        are not cached are built on the sandboxed workers when there are any, and files whose
+        build failed there are built as bad files instead. Failures caused by the workers'
+        environment, e.g. a library that can't be loaded under the memory limit, stop the run
+        """
+        if self.executor is None:
+            if self.batch_phash:
+                hash_values = {**self._batch_phash(paths, cached, hash_values), **hash_values}
+            return [create_file(path, metadata.get(path), cached.get(path), hash_values.get(path))
+                    for path in paths]
+
+        uncached = [path for path in paths if path not in cached]
+        built = {}
+        for path, result in zip(uncached, self.executor.map(
+                create_file, uncached, [metadata.get(path) for path in uncached],
+                [None] * len(uncached), [hash_values.get(path) for path in uncached])):
+            if isinstance(result, SandboxFailure):
+                if result.fatal:
+                    raise RuntimeError(f"Building {path} failed, it {result}. This isn't caused "
+                                       f"by the file, check the installed libraries, the file "
+                                       f"memory limit and that main() is only called under "
+                                       f"an `if __name__ == \"__main__\"` guard")
+                self.sandbox_failures.add(path)
+                print(f"Marking {path} as a bad file, it {result}")
+                self.metrics.count("sandbox failures")
+                result = create_bad_file(path, metadata.get(path))
+            built[path] = result
+        return [create_file(path, cached=cached[path]) if path in cached else built[path]
+                for path in paths]
+
+    def _batch_phash(self, paths: list[str], cached: dict[str, dict],
+                     hash_values: dict[str, str]) -> dict[str, str]:
+        """
+        Returns the perceptual hashes of the images among paths that still need hashing, by path.
+        Images that fail to decode are left out and hashed one by one, so that they are marked
+        as bad files as usual. Files hashed from their embedded previews are hashed one by one
+        too. This only runs in-process, since decoding in the main process would bypass the
+        sandboxed workers
+        """
+        image_paths = [path for path in paths if path not in cached
+                       and path not in hash_values and get_file_class(path)[1] is Image
+                       and not (Image.preview_hash
+                                and path.endswith(Image.get_preview_formats()))]
+        if not image_paths:
+            return {}
+        with self.metrics.timer("hash", "Images", files=len(image_paths)):
+            return PhashHelper(draft=Image.draft_decode).phash_paths(image_paths)
+
+    def _staged_preprocess(self) -> None:
+        """
+        Pre-processes the whole tree in stages, so that byte-identical files are found from their
+        sizes and partial hashes before any file is decoded. Without perceptual hashing, files
+        are grouped by their content keys alone. With it, one file of every set of identical
+        files is perceptually hashed and the others reuse its hash.
+
+        A content key depends on the other files of the same size, so the files built before an
+        interruption are keyed again together with the pending ones. They stay the
+        representatives of their contents, and their pending copies reuse their records
+        """
+        built_files = {this_file.path: this_file
+                       for groups in self.groups.values() for this_file in groups.members}
+        sizes = {}
+        pending_entries = {}
+        for _, entries, _ in self.metrics.iter_timed(
+                "scandir", "All", walk_files(self.root_path, self.WALK_BATCH_SIZE),
+                lambda batch: len(batch[1])):
+            for entry in entries:
+                if self._is_pending(entry.path):
+                    sizes[entry.path] = entry.stat().st_size
+                    pending_entries[entry.path] = entry
+                elif entry.path in built_files:
+                    sizes[entry.path] = entry.stat().st_size
+
+        content_keys = StagedHashHelper().get_content_keys(sizes)
+        representatives = {content_keys[path]: path
+                           for path in content_keys if path not in pending_entries}
+        representative_paths = []
+        copies = {}
+        for path in pending_entries:
+            content_key = content_keys[path]
+            if content_key in representatives:
+                copies[path] = representatives[content_key]
             else:
-                # case 4
-                files.pop(0)
-
-        # Add this dir into the compeled_directories list, and remove all associated files from
-        # completed_files
-        self.state["completed_directories"].append(path)
-        self.__remove_completed_files_for_directory(path)
-        print("removal complete x2")
-
-    def __compare(self, preprocessed_file: File, current_file: File):
+                representatives[content_key] = path
+                representative_paths.append(path)
+        print(f"{len(pending_entries)} files, {len(representative_paths)} with unique contents")
+        self.metrics.start_progress("pre-process", len(pending_entries))
+
+        hash_values = None if self.perceptual else content_keys
+        for i in range(0, len(representative_paths), self.STAGED_BATCH_SIZE):
+            built_files.update(self._preprocess_paths(
+                representative_paths[i:i + self.STAGED_BATCH_SIZE], hash_values,
+                pending_entries))
+            if self.checkpoint is not None:
+                self.checkpoint.maybe_commit(self.state["state"])
+
+        # Copies take their representative's whole record, so that copies of a bad file are bad
+        # files too, and only keep their own modify date
+        copy_paths = list(copies)
+        for i in range(0, len(copy_paths), self.STAGED_BATCH_SIZE):
+            batch = copy_paths[i:i + self.STAGED_BATCH_SIZE]
+            self._preprocess_paths(batch, records={
+                path: {**built_files[copies[path]].get_cache_record(),
+                       "modify_time": File.get_stat_modify_time(pending_entries[path].stat())}
+                for path in batch})
+            if self.checkpoint is not None:
+                self.checkpoint.maybe_commit(self.state["state"])
+
+    def _add_file(self, file_type: str, this_file: File) -> None:
         """
-        Compares the two files based on File's inequality attributes
+        Adds a pre-processed File to the groups of its file type, grouping it with any file that
+        has the same hash. A new hash is also merged with every group that has a hash within
+        the file type's near-duplicate threshold. Originals are picked by select_originals
         """
-        if preprocessed_file >= current_file:
-            preprocessed_file.add(current_file)
-        else:
-            preprocessed_file.swap(current_file)
-
-    def __remove_completed_files_for_directory(self, dir_path):
-        print("Removing completed directories")
-        def not_match_dir(w):
-            return dir_path not in w
-
-        filter(not_match_dir, self.state["completed_files"])
-        print("removal complete")
-
-        return self.state
-
-    def remove_empty_folders(self, path):
+        this_hash = this_file.get_hash()
+        groups = self.groups[file_type]
+        is_new_hash = this_hash not in groups
+        groups.add(this_file, this_hash)
+        if is_new_hash and file_type in self.near_duplicate_indexes:
+            for near_hash in self._find_near_duplicates(file_type, this_file):
+                groups.merge(this_hash, near_hash)
+
+    def _find_near_duplicates(self, file_type: str, this_file: File) -> list[str | int]:
         """
-        Walk the directory tree from bottom to top and remove empty folders
-        TODO: Create folder directories more efficiently so that these repeated steps are not
-              necessary
+        Returns the hashes within the file type's threshold of the file's perceptual hash or
+        Simhash, and adds the file's hash to the index
+        """
+        if this_file.is_bad():
+            # Bad files are hashed by their photorec number, not by their contents
+            return []
+        this_hash = this_file.get_hash()
+        # Image hashes are hex strings, Text hashes are already integers
+        hash_value = this_hash if isinstance(this_hash, int) else int(this_hash, 16)
+        index, threshold = self.near_duplicate_indexes[file_type]
+        near_hashes = [near_hash for _, _, near_hash in index.find(hash_value, threshold)]
+        index.add(hash_value, this_hash)
+        return near_hashes
+
+    def remove_empty_folders(self):
+        """
+        Removes the folders that sorting moved files out of, and their parents, if they were
+        left empty. The rest of the tree isn't touched
         """
         print("Removing empty directories...")
-        for dirpath, dirnames, _ in os.walk(path, topdown=False):
-            for dirname in dirnames:
-                full_path = os.path.join(dirpath, dirname)
-                # If the directory is empty, remove it
-                if not os.listdir(full_path):
-                    os.rmdir(full_path)
+        removed = self.directories.remove_empty()
+        if self.verbose:
+            print(f"Removed {removed} empty directories")
+
+
+def positive_int(value: str) -> int:
+    """
+    Parses a command line argument that must be a whole number of at least 1
+    """
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, got {number}")
+    return number
 
 
-def main(path):
+def parse_args(argv: list[str]) -> argparse.Namespace:
+    """
+    Parses the command line arguments
+    """
+    parser = argparse.ArgumentParser(description="Sorts and de-duplicates photorec output")
+    parser.add_argument("path", nargs="?", help="root directory of the recovered files")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="number of processes used to pre-process files in parallel")
+    parser.add_argument("--cache", default=DEFAULT_CACHE_PATH,
+                        help="path of the metadata and hash cache")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="don't read or write the metadata and hash cache")
+    parser.add_argument("--cache-size", type=int, default=1024,
+                        help="maximum size of the cached records in MB")
+    parser.add_argument("--checkpoint-dir",
+                        help="directory the run's progress is saved to, defaults to one per path "
+                             "under ~/.cache")
+    parser.add_argument("--no-checkpoint", action="store_true",
+                        help="don't save progress or resume a previous run")
+    parser.add_argument("--fresh", action="store_true",
+                        help="discard the progress of a previous run instead of resuming it")
+    parser.add_argument("--image-threshold", type=int, default=0,
+                        help="group images and videos whose perceptual hashes differ by at most "
+                             "this many bits, 0 only groups identical hashes")
+    parser.add_argument("--text-threshold", type=int, default=0,
+                        help="group text documents whose Simhashes differ by at most this many "
+                             "bits, 0 only groups identical hashes")
+    parser.add_argument("--staged", action="store_true",
+                        help="find byte-identical files by size and partial hashes first, and "
+                             "group files by their contents instead of perceptual hashes")
+    parser.add_argument("--perceptual", action="store_true",
+                        help="with --staged, also hash one copy of every unique file "
+                             "perceptually so that similar files are grouped")
+    parser.add_argument("--video-frames", type=positive_int, default=1,
+                        help="number of keyframes combined into every video's hash")
+    parser.add_argument("--video-timeout", type=float, default=10,
+                        help="seconds allowed for decoding each video keyframe before the video "
+                             "is marked as a bad file")
+    parser.add_argument("--text-max-pages", type=int,
+                        help="maximum number of pdf pages read from each text document")
+    parser.add_argument("--text-max-chars", type=int,
+                        help="maximum number of characters read from each text document")
+    parser.add_argument("--file-timeout", type=float,
+                        help="seconds allowed for pre-processing each file before it is marked "
+                             "as a bad file")
+    parser.add_argument("--file-memory-limit", type=int,
+                        help="memory allowed for pre-processing each file in MB before it is "
+                             "marked as a bad file")
+    parser.add_argument("--verbose", action="store_true",
+                        help="print every directory as it is pre-processed and the number of "
+                             "empty directories removed")
+    parser.add_argument("--progress-interval", type=float, default=10,
+                        help="seconds between progress lines")
+    parser.add_argument("--metrics-json", metavar="PATH",
+                        help="write the per stage counters and latencies to PATH as JSON")
+    parser.add_argument("--profile", choices=("cprofile", "pyinstrument"),
+                        help="profile the run and print the results at its end")
+    parser.add_argument("--profile-output", metavar="PATH",
+                        help="with --profile, save the cProfile stats or pyinstrument HTML "
+                             "report to PATH")
+    parser.add_argument("--batch-phash", action="store_true",
+                        help="hash the images of every batch in one vectorized pass, without "
+                             "changing their hashes. Only used with a single worker and no file "
+                             "timeout or memory limit")
+    parser.add_argument("--draft-decode", action="store_true",
+                        help="decode JPEGs at a reduced size before hashing them. Much faster "
+                             "for large photos, but hashes differ slightly from full decodes")
+    parser.add_argument("--fast-image-hash", action="store_true",
+                        help="hash raw, layered and HEIC images from their embedded JPEG "
+                             "previews and decode JPEGs at a reduced size, implies "
+                             "--draft-decode. Hashes differ slightly from full decodes, see "
+                             "benchmarks/preview_consistency.py")
+    parser.add_argument("--pipeline", action="store_true",
+                        help="overlap walking, exiftool, hashing and indexing while "
+                             "pre-processing, ignored with --staged")
+    parser.add_argument("--metadata-concurrency", type=int, default=2,
+                        help="with --pipeline, number of batches fetching metadata at once")
+    parser.add_argument("--library", metavar="LIBRARY",
+                        help="ingest the recovered files into the sorted library LIBRARY, only "
+                             "hashing the new files and grouping them with the library's "
+                             "indexed originals")
+    parser.add_argument("--library-index", metavar="PATH",
+                        help="path of the library index, defaults to a file in LIBRARY")
+    parser.add_argument("--move-workers", type=int, default=1,
+                        help="number of threads moving files into different directories")
+    parser.add_argument("--verify-copies", choices=("size", "hash"), default="size",
+                        help="how files copied to another filesystem are verified before the "
+                             "source is removed")
+    parser.add_argument("--plan-only", metavar="PLAN",
+                        help="pre-process and write the sort plan to PLAN without moving files")
+    parser.add_argument("--execute-plan", metavar="PLAN",
+                        help="make the moves of a saved plan without pre-processing")
+    parser.add_argument("--undo-plan", metavar="PLAN",
+                        help="move the files of an executed plan back to where they were")
+    args = parser.parse_args(argv)
+    if args.path is None and not (args.execute_plan or args.undo_plan):
+        parser.error("the path is required unless a plan is executed or undone")
+    if args.library is not None:
+        if args.plan_only or args.execute_plan or args.undo_plan:
+            # Plans don't record the library index updates of their moves
+            parser.error("--library can't be used with --plan-only, --execute-plan or "
+                         "--undo-plan")
+        if args.staged and not args.perceptual:
+            parser.error("--library needs perceptual hashes, add --perceptual to --staged")
+        library, path = os.path.abspath(args.library), os.path.abspath(args.path)
+        if os.path.commonpath([library, path]) in (library, path):
+            parser.error("the library and the path can't contain each other")
+    elif args.library_index is not None:
+        parser.error("--library-index needs --library")
+    return args
+
+
+def main(args: argparse.Namespace):
     """
     Runs the main code
     """
-    interrupted = False
-    cleaner = DupeCleaner(path)
+    transfer = TransferHelper(verify=args.verify_copies)
+    if args.execute_plan:
+        plan_file = PlanFileHelper(transfer, workers=args.move_workers)
+        print(f"Moved {plan_file.execute(args.execute_plan)} files")
+        print(transfer.get_report())
+        return
+    if args.undo_plan:
+        print(f"Moved back {PlanFileHelper(transfer).undo(args.undo_plan)} files")
+        print(transfer.get_report())
+        return
 
-    while not interrupted:
-        cleaner.next()
+    interrupted = False
+    metrics = MetricsHelper(progress_interval=args.progress_interval)
+    cache = None
+    if not args.no_cache:
+        cache = CacheHelper(args.cache, max_bytes=args.cache_size * 1024 ** 2)
+    checkpoint = None
+    if not args.no_checkpoint:
+        checkpoint = CheckpointHelper(
+            args.checkpoint_dir or CheckpointHelper.get_default_directory(args.path))
+        if args.fresh:
+            checkpoint.clear()
+    library = None
+    if args.library is not None:
+        library = LibraryIndexHelper(args.library, args.library_index)
+    cleaner = DupeCleaner(args.path, workers=args.workers, cache=cache, checkpoint=checkpoint,
+                          image_threshold=args.image_threshold,
+                          text_threshold=args.text_threshold, staged=args.staged,
+                          perceptual=args.perceptual,
+                          file_settings={"Video": {"frame_count": args.video_frames,
+                                                   "decode_timeout": args.video_timeout},
+                                         "Text": {"max_pages": args.text_max_pages,
+                                                  "max_chars": args.text_max_chars},
+                                         "Image": {"draft_decode": (args.draft_decode
+                                                                    or args.fast_image_hash),
+                                                   "preview_hash": args.fast_image_hash}},
+                          move_workers=args.move_workers, plan_path=args.plan_only,
+                          transfer=transfer, file_timeout=args.file_timeout,
+                          file_memory_limit=(args.file_memory_limit * 1024 ** 2
+                                             if args.file_memory_limit else None),
+                          metrics=metrics, verbose=args.verbose, batch_phash=args.batch_phash,
+                          pipeline=args.pipeline,
+                          metadata_concurrency=args.metadata_concurrency, library=library)
+    try:
+        cleaner.resume()
+    except RuntimeError as e:
+        cleaner.close()
+        sys.exit(str(e))
+
+    def handle_terminate(_signum, _frame):
+        raise KeyboardInterrupt
+
+    signal.signal(signal.SIGTERM, handle_terminate)
+    try:
+        with run_profiler(args.profile, args.profile_output):
+            while not interrupted:
+                try:
+                    cleaner.next()
+                except KeyboardInterrupt:
+                    interrupted = True
+                    cleaner.save()
+                    print("Interrupted, progress has been saved")
+    finally:
+        print(metrics.get_report())
+        if args.metrics_json:
+            metrics.write_json(args.metrics_json)
 
 if __name__=="__main__":
-    path = sys.argv[1]
-    main(path)
+    main(parse_args(sys.argv[1:]))
@@ -0,0 +1,47 @@
+"""
+Shared test helpers. The repository isn't installed as a package, so its root is put on the path
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from classes.file import Image, Text, Video  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def restore_file_class_settings():
+    """
+    Restores the class level File settings a test changed through configure_file_classes
+    """
+    settings = {file_class: dict(vars(file_class)) for file_class in (Image, Video, Text)}
+    yield
+    for file_class, values in settings.items():
+        for name in set(vars(file_class)) - set(values):
+            delattr(file_class, name)
+        for name, value in values.items():
+            if vars(file_class).get(name) is not value:
+                setattr(file_class, name, value)
+
+
+def make_image(seed: int, size: tuple[int, int] = (1600, 1200), mode: str = "RGB"):
+    """
+    Returns a smooth random image, upscaled from a small block pattern so that its perceptual
+    hash survives resizing and recompression
+    """
+    import numpy
+    import PIL.Image
+
+    rng = numpy.random.default_rng(seed)
+    blocks = PIL.Image.fromarray((rng.random((12, 16, 3)) * 255).astype("uint8"))
+    return blocks.resize(size, PIL.Image.BICUBIC).convert(mode)
+
+
+def make_metadata(path: str, **tags) -> dict:
+    """
+    Returns the exiftool metadata the File classes need, plus any given tags
+    """
+    return {"SourceFile": path, "FileSize": f"{os.path.getsize(path)} bytes",
+            "FileModifyDate": "2016:11:22 15:37:40+08:00", **tags}
@@ -0,0 +1,82 @@
+"""
+Checks that the cache keeps its records within max_bytes, least recently used first
+"""
+import json
+import types
+
+from helpers.cache_helper import CacheHelper
+
+
+class FakeFile:
+    """
+    Stands in for a File with a cache record of about the given size
+    """
+    def __init__(self, index: int, record_size: int = 100):
+        self.path = f"/recup/recup_dir.1/f{index:07d}.jpg"
+        self.record = {"hash_value": "x" * (record_size - 18)}
+
+    def get_cache_record(self) -> dict:
+        return self.record
+
+    def get_hash_version(self) -> str:
+        return "1"
+
+
+def make_stat(index: int):
+    return types.SimpleNamespace(st_dev=1, st_ino=index, st_size=1000, st_mtime_ns=5)
+
+
+def put_files(cache: CacheHelper, indexes) -> None:
+    for index in indexes:
+        cache.put(FakeFile(index), make_stat(index))
+
+
+def get_cached(cache: CacheHelper, indexes) -> set[int]:
+    stats = {FakeFile(index).path: make_stat(index) for index in indexes}
+    records = cache.get_many(stats, {path: ("FakeFile", "1") for path in stats})
+    return {index for index in indexes if FakeFile(index).path in records}
+
+
+def get_stored_size(cache: CacheHelper) -> int:
+    return cache.connection.execute("SELECT SUM(record_size) FROM files").fetchone()[0]
+
+
+def test_records_are_returned(tmp_path):
+    with CacheHelper(str(tmp_path / "cache.sqlite")) as cache:
+        put_files(cache, range(3))
+        stats = {FakeFile(0).path: make_stat(0)}
+        assert cache.get_many(stats, {FakeFile(0).path: ("FakeFile", "1")}) == {
+            FakeFile(0).path: FakeFile(0).record}
+        assert cache.get_many(stats, {FakeFile(0).path: ("FakeFile", "2")}) == {}
+
+
+def test_least_recently_used_records_are_evicted(tmp_path, monkeypatch):
+    clock = iter(range(1000))
+    monkeypatch.setattr("helpers.cache_helper.time.time", lambda: next(clock))
+    record_size = len(json.dumps(FakeFile(0).record))
+    with CacheHelper(str(tmp_path / "cache.sqlite"), max_bytes=5 * record_size) as cache:
+        put_files(cache, range(5))
+        # Using the oldest records makes them the most recently used
+        assert get_cached(cache, [0, 1]) == {0, 1}
+        put_files(cache, range(5, 8))
+        cache.commit()
+        assert cache.total_size == get_stored_size(cache) == 5 * record_size
+        assert get_cached(cache, range(8)) == {0, 1, 5, 6, 7}
+
+
+def test_total_size_follows_replaced_records_and_reopening(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    with CacheHelper(path) as cache:
+        put_files(cache, range(4))
+        cache.put(FakeFile(2, record_size=300), make_stat(2))
+        assert cache.total_size == get_stored_size(cache)
+    with CacheHelper(path) as cache:
+        assert cache.total_size == get_stored_size(cache)
+
+
+def test_uses_dont_force_commits(tmp_path):
+    with CacheHelper(str(tmp_path / "cache.sqlite")) as cache:
+        put_files(cache, range(3))
+        cache.commit()
+        get_cached(cache, range(3))
+        assert cache.pending_writes == 0
@@ -0,0 +1,44 @@
+"""
+Checks the tracking of pre-processed files and directories
+"""
+from helpers.completed_index_helper import CompletedIndex
+
+
+def test_files_are_completed_one_by_one():
+    index = CompletedIndex()
+    index.complete_file("/recup/recup_dir.1/f0001.jpg")
+    assert index.is_file_completed("/recup/recup_dir.1/f0001.jpg")
+    assert not index.is_file_completed("/recup/recup_dir.1/f0002.jpg")
+    assert not index.is_file_completed("/recup/recup_dir.2/f0001.jpg")
+    assert not index.is_directory_completed("/recup/recup_dir.1")
+    assert len(index) == 1
+
+
+def test_completing_a_directory_covers_its_files():
+    index = CompletedIndex()
+    index.complete_file("/recup/recup_dir.1/f0001.jpg")
+    index.complete_file("/recup/recup_dir.1/f0002.jpg")
+    index.complete_file("/recup/recup_dir.2/f0001.jpg")
+    assert len(index) == 3
+    index.complete_directory("/recup/recup_dir.1")
+    assert index.is_directory_completed("/recup/recup_dir.1")
+    assert index.is_file_completed("/recup/recup_dir.1/f0003.jpg")
+    assert index.is_file_completed("/recup/recup_dir.2/f0001.jpg")
+    # The directory's files are forgotten and only the directory is kept
+    assert len(index) == 2
+
+
+def test_paths_are_normalized():
+    index = CompletedIndex()
+    index.complete_directory("/recup/recup_dir.1/")
+    index.complete_file("/recup//recup_dir.2/./f0001.jpg")
+    assert index.is_directory_completed("/recup/recup_dir.1")
+    assert index.is_file_completed("/recup/recup_dir.1/sub/../f0001.jpg")
+    assert index.is_file_completed("/recup/recup_dir.2/f0001.jpg")
+
+
+def test_subdirectories_are_not_covered():
+    index = CompletedIndex()
+    index.complete_directory("/recup")
+    assert not index.is_file_completed("/recup/recup_dir.1/f0001.jpg")
+    assert not index.is_directory_completed("/recup/recup_dir.1")
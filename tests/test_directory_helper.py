@@ -0,0 +1,37 @@
+"""
+Checks that cleaning up removes the vacated directories under every root and nothing else
+"""
+import os
+
+from helpers.directory_helper import DirectoryHelper
+
+
+def test_removes_vacated_directories_under_every_root(tmp_path):
+    recovered = tmp_path / "recovered"
+    library = tmp_path / "library"
+    recovered_folder = recovered / "recup_dir.1"
+    library_folder = library / "Originals" / "2016" / "11" / "22"
+    recovered_folder.mkdir(parents=True)
+    library_folder.mkdir(parents=True)
+    (library / "Originals" / "2019").mkdir()
+
+    directories = DirectoryHelper(str(recovered), str(library))
+    directories.record_vacated(str(recovered_folder))
+    directories.record_vacated(str(library_folder))
+    assert directories.remove_empty() == 4
+    assert sorted(os.listdir(library)) == ["Originals"]
+    assert os.listdir(library / "Originals") == ["2019"]
+    assert os.listdir(recovered) == []
+
+
+def test_never_removes_a_root_or_anything_outside_the_roots(tmp_path):
+    root = tmp_path / "root"
+    outside = tmp_path / "outside"
+    root.mkdir()
+    outside.mkdir()
+
+    directories = DirectoryHelper(str(root))
+    directories.record_vacated(str(root))
+    directories.record_vacated(str(outside))
+    assert directories.remove_empty() == 0
+    assert root.is_dir() and outside.is_dir()
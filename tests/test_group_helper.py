@@ -0,0 +1,92 @@
+"""
+Checks the grouping of duplicates and the pick of every group's original
+"""
+from helpers.group_helper import GroupHelper
+
+
+class FakeFile:
+    """
+    Stands in for a File, ranked by the given key
+    """
+    def __init__(self, name: str, rank: tuple = (True, False, True, 0)):
+        self.name = name
+        self.rank = rank
+        self.duplicates = []
+
+    def get_rank_key(self) -> tuple:
+        return self.rank
+
+    def __repr__(self):
+        return self.name
+
+
+def names(files) -> list[str]:
+    return [file.name for file in files]
+
+
+def test_files_with_the_same_hash_are_grouped():
+    groups = GroupHelper()
+    a, b, c = FakeFile("a"), FakeFile("b"), FakeFile("c")
+    groups.add(a, "x")
+    groups.add(b, "y")
+    groups.add(c, "x")
+    assert len(groups) == 3
+    assert "x" in groups and "z" not in groups
+    originals = groups.get_originals()
+    assert originals == {"x": a, "y": b}
+    assert names(a.duplicates) == ["c"]
+    assert b.duplicates == []
+
+
+def test_merges_are_transitive():
+    groups = GroupHelper()
+    files = [FakeFile(str(index)) for index in range(5)]
+    for index, file in enumerate(files):
+        groups.add(file, index)
+    # A chain of near-duplicates whose ends are too far apart to match directly
+    groups.merge(0, 1)
+    groups.merge(2, 1)
+    groups.merge(3, 2)
+    originals = groups.get_originals()
+    assert list(originals) == [0, 4]
+    assert names(originals[0].duplicates) == ["1", "2", "3"]
+    assert groups.get_group_sizes() == {4: 1, 1: 1}
+
+
+def test_highest_rank_is_picked_and_ties_keep_the_earliest():
+    groups = GroupHelper()
+    small = FakeFile("small", (True, False, True, 10))
+    large = FakeFile("large", (True, False, True, 500))
+    tied = FakeFile("tied", (True, False, True, 500))
+    bad = FakeFile("bad", (False, True, True, 10 ** 6))
+    for file in (small, bad, large, tied):
+        groups.add(file, "hash")
+    originals = groups.get_originals()
+    # The group is still keyed by the hash of its first file
+    assert originals == {"hash": large}
+    assert names(large.duplicates) == ["small", "bad", "tied"]
+
+
+def test_repeated_picks_reset_duplicates():
+    groups = GroupHelper()
+    first = FakeFile("first", (True, False, True, 10))
+    second = FakeFile("second", (True, False, True, 20))
+    groups.add(first, "a")
+    groups.add(FakeFile("copy", (True, False, True, 1)), "a")
+    groups.get_originals()
+    assert names(first.duplicates) == ["copy"]
+
+    groups.add(second, "b")
+    groups.merge("a", "b")
+    originals = groups.get_originals()
+    assert originals == {"a": second}
+    assert first.duplicates == []
+    assert names(second.duplicates) == ["first", "copy"]
+
+
+def test_group_sizes():
+    groups = GroupHelper()
+    for index in range(6):
+        groups.add(FakeFile(str(index)), index // 3 if index < 5 else "single")
+    assert groups.get_group_sizes() == {3: 1, 2: 1, 1: 1}
+    assert GroupHelper().get_group_sizes() == {}
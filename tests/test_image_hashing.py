@@ -0,0 +1,105 @@
+"""
+Checks the fast image hashing paths against full-decode hashes
+"""
+import io
+
+import pytest
+
+pytest.importorskip("imagehash")
+
+from classes.file import Image, configure_file_classes  # noqa: E402
+from helpers.exiftool_helper import ExiftoolHelper  # noqa: E402
+from helpers.near_duplicate_helper import hamming_distance  # noqa: E402
+from conftest import make_image, make_metadata  # noqa: E402
+
+# Hamming distance a fast hash may differ from the full-decode hash of the same image by
+MAX_DISTANCE = 4
+
+
+def hash_image(path: str, metadata: dict, fast: bool) -> str:
+    configure_file_classes({"Image": {"draft_decode": fast, "preview_hash": fast}})
+    image = Image(path, metadata)
+    assert not image.is_bad()
+    return image.get_hash()
+
+
+def get_distance(first: str, second: str) -> int:
+    return hamming_distance(int(first, 16), int(second, 16))
+
+
+@pytest.mark.parametrize("seed", range(8))
+def test_preview_hash_matches_full_decode(tmp_path, monkeypatch, seed):
+    path = str(tmp_path / f"f{seed:07d}.tif")
+    image = make_image(seed)
+    image.save(path)
+    preview = io.BytesIO()
+    image.resize((640, 480)).save(preview, "JPEG", quality=85)
+    extracted = []
+
+    def get_binary(extract_path, tag):
+        extracted.append((extract_path, tag))
+        return preview.getvalue()
+
+    monkeypatch.setattr(ExiftoolHelper, "get_binary", get_binary)
+    metadata = make_metadata(path, PreviewImage="(Binary data 1234 bytes)",
+                             ThumbnailImage="(Binary data 123 bytes)")
+
+    full_hash = hash_image(path, metadata, fast=False)
+    fast_hash = hash_image(path, metadata, fast=True)
+    assert extracted == [(path, "PreviewImage")]
+    assert get_distance(full_hash, fast_hash) <= MAX_DISTANCE
+
+
+def test_photoshop_thumbnail_is_a_preview(tmp_path, monkeypatch):
+    path = str(tmp_path / "f0000001.tif")
+    make_image(1).save(path)
+    thumbnail = io.BytesIO()
+    make_image(1, (160, 120)).save(thumbnail, "JPEG")
+    monkeypatch.setattr(ExiftoolHelper, "get_binary", lambda *_: thumbnail.getvalue())
+    metadata = make_metadata(path, PhotoshopThumbnail="(Binary data 1234 bytes)")
+
+    assert get_distance(hash_image(path, metadata, fast=False),
+                        hash_image(path, metadata, fast=True)) <= MAX_DISTANCE
+
+
+def test_files_without_a_usable_preview_are_fully_decoded(tmp_path, monkeypatch):
+    path = str(tmp_path / "f0000001.tif")
+    make_image(1).save(path)
+    monkeypatch.setattr(ExiftoolHelper, "get_binary", lambda *_: b"not a jpeg")
+
+    full_hash = hash_image(path, make_metadata(path), fast=False)
+    assert hash_image(path, make_metadata(path), fast=True) == full_hash
+    broken = make_metadata(path, PreviewImage="(Binary data 10 bytes)")
+    assert hash_image(path, broken, fast=True) == full_hash
+
+
+@pytest.mark.parametrize("fast", [False, True])
+@pytest.mark.parametrize("name, contents", [("f0000001.jpg", b"not an image"),
+                                            ("f0000002.png", b""),
+                                            ("f0000003.gif", b"GIF89a")])
+def test_unreadable_images_are_bad_files(tmp_path, monkeypatch, fast, name, contents):
+    path = tmp_path / name
+    path.write_bytes(contents)
+    monkeypatch.setattr(ExiftoolHelper, "get_binary", lambda *_: None)
+    configure_file_classes({"Image": {"draft_decode": fast, "preview_hash": fast}})
+
+    image = Image(str(path), make_metadata(str(path), PreviewImage="(Binary data 10 bytes)"))
+    assert image.is_bad()
+    assert image.get_hash() == name[1:8]
+
+
+@pytest.mark.parametrize("seed", range(8))
+def test_draft_decode_matches_full_decode(tmp_path, seed):
+    path = str(tmp_path / f"f{seed:07d}.jpg")
+    make_image(seed, (3000, 2000)).save(path, quality=90)
+    metadata = make_metadata(path)
+
+    assert get_distance(hash_image(path, metadata, fast=False),
+                        hash_image(path, metadata, fast=True)) <= MAX_DISTANCE
+
+
+def test_fast_hashes_have_their_own_hash_version():
+    configure_file_classes({"Image": {"draft_decode": False, "preview_hash": False}})
+    full_version = Image.get_hash_version()
+    configure_file_classes({"Image": {"draft_decode": True, "preview_hash": True}})
+    assert Image.get_hash_version() != full_version
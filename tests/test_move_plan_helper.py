@@ -0,0 +1,53 @@
+"""
+Checks that planned destinations never collide
+"""
+import os
+
+from helpers.move_plan_helper import MovePlanHelper
+
+
+def test_free_paths_are_kept(tmp_path):
+    plan = MovePlanHelper()
+    path = str(tmp_path / "photo.jpg")
+    assert plan.reserve(path) == path
+
+
+def test_collisions_get_numbered_suffixes(tmp_path):
+    plan = MovePlanHelper()
+    path = str(tmp_path / "20161122 153740.jpg")
+    reserved = [plan.reserve(path) for _ in range(4)]
+    assert [os.path.basename(name) for name in reserved] == [
+        "20161122 153740.jpg", "20161122 153740#1#.jpg",
+        "20161122 153740#2#.jpg", "20161122 153740#3#.jpg"]
+
+
+def test_existing_files_are_skipped(tmp_path):
+    for name in ("photo.jpg", "photo#1#.jpg", "photo#3#.jpg"):
+        (tmp_path / name).write_bytes(b"")
+    plan = MovePlanHelper()
+    path = str(tmp_path / "photo.jpg")
+    reserved = [os.path.basename(plan.reserve(path)) for _ in range(3)]
+    assert reserved == ["photo#2#.jpg", "photo#4#.jpg", "photo#5#.jpg"]
+
+
+def test_claimed_and_suffixed_names_are_taken(tmp_path):
+    plan = MovePlanHelper()
+    plan.claim(str(tmp_path / "a.txt"))
+    # A file that happens to be named like a suffixed collision
+    assert plan.reserve(str(tmp_path / "a#1#.txt")) == str(tmp_path / "a#1#.txt")
+    assert plan.reserve(str(tmp_path / "a.txt")) == str(tmp_path / "a#2#.txt")
+
+
+def test_directories_are_independent(tmp_path):
+    plan = MovePlanHelper()
+    first = str(tmp_path / "Originals" / "a.jpg")
+    second = str(tmp_path / "Duplicates" / "a.jpg")
+    assert plan.reserve(first) == first
+    assert plan.reserve(second) == second
+
+
+def test_names_without_extension(tmp_path):
+    plan = MovePlanHelper()
+    path = str(tmp_path / "README")
+    plan.reserve(path)
+    assert plan.reserve(path) == str(tmp_path / "README#1#")
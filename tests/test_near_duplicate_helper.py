@@ -0,0 +1,85 @@
+"""
+Checks the near-duplicate indexes against a brute force search
+"""
+import random
+
+import pytest
+
+from helpers.near_duplicate_helper import BKTree, SimhashIndex, hamming_distance
+
+
+def make_values(seed: int, count: int = 400) -> list[int]:
+    """
+    Returns random 64-bit hashes, with clusters of near-duplicates a few bits apart
+    """
+    rng = random.Random(seed)
+    values = []
+    while len(values) < count:
+        value = rng.getrandbits(64)
+        values.append(value)
+        for _ in range(rng.randrange(4)):
+            flipped = value
+            for bit in rng.sample(range(64), rng.randrange(1, 8)):
+                flipped ^= 1 << bit
+            values.append(flipped)
+    return values
+
+
+def brute_force(values: list[int], query: int, threshold: int) -> list[tuple[int, int, object]]:
+    return sorted((hamming_distance(query, value), order, f"item {order}")
+                  for order, value in enumerate(values)
+                  if hamming_distance(query, value) <= threshold)
+
+
+def build(index, values: list[int]):
+    for order, value in enumerate(values):
+        index.add(value, f"item {order}")
+    return index
+
+
+def test_hamming_distance():
+    assert hamming_distance(0, 0) == 0
+    assert hamming_distance(0b1011, 0b0001) == 2
+    assert hamming_distance(0, (1 << 64) - 1) == 64
+
+
+@pytest.mark.parametrize("seed", range(3))
+@pytest.mark.parametrize("threshold", [0, 1, 4, 10])
+def test_bk_tree_finds_every_match(seed, threshold):
+    values = make_values(seed)
+    tree = build(BKTree(), values)
+    assert len(tree) == len(values)
+    for query in values[::7] + make_values(seed + 100, 20):
+        assert sorted(tree.find(query, threshold)) == brute_force(values, query, threshold)
+
+
+@pytest.mark.parametrize("seed", range(3))
+@pytest.mark.parametrize("max_distance, threshold", [(0, 0), (3, 3), (3, 1), (6, 6)])
+def test_simhash_index_finds_every_match(seed, max_distance, threshold):
+    values = make_values(seed)
+    index = build(SimhashIndex(max_distance), values)
+    assert len(index) == len(values)
+    for query in values[::7] + make_values(seed + 100, 20):
+        assert sorted(index.find(query, threshold)) == brute_force(values, query, threshold)
+
+
+def test_simhash_index_defaults_to_max_distance():
+    values = make_values(0)
+    index = build(SimhashIndex(3), values)
+    assert sorted(index.find(values[0])) == brute_force(values, values[0], 3)
+
+
+def test_simhash_index_rejects_larger_threshold():
+    with pytest.raises(ValueError):
+        SimhashIndex(3).find(0, 4)
+
+
+def test_duplicate_values_are_all_found():
+    for index in (BKTree(), SimhashIndex(2)):
+        build(index, [5, 5, 5])
+        assert sorted(index.find(5, 0)) == [(0, 0, "item 0"), (0, 1, "item 1"), (0, 2, "item 2")]
+
+
+def test_empty_indexes():
+    assert BKTree().find(0, 64) == []
+    assert SimhashIndex(3).find(0) == []
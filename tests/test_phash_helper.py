@@ -0,0 +1,70 @@
+"""
+Checks that the batched hashes of PhashHelper are bit-identical to imagehash's
+"""
+import pytest
+
+imagehash = pytest.importorskip("imagehash")
+
+from helpers.phash_helper import PhashHelper  # noqa: E402
+from conftest import make_image  # noqa: E402
+
+HASHES = [("phash_paths", imagehash.phash),
+          ("average_hash_paths", imagehash.average_hash),
+          ("dhash_paths", imagehash.dhash)]
+
+
+@pytest.fixture(scope="module")
+def image_paths(tmp_path_factory):
+    """
+    Writes images in every format and mode the cleaner hashes
+    """
+    import numpy
+    import PIL.Image
+
+    directory = tmp_path_factory.mktemp("images")
+    paths = []
+    for seed in range(4):
+        for name, image in [
+            ("jpg", make_image(seed, (640, 480))),
+            ("png", make_image(seed, (333, 517))),
+            ("gif", make_image(seed, (200, 150)).convert("P")),
+            ("rgba.png", make_image(seed, (300, 300), "RGBA")),
+            ("grey.png", make_image(seed, (256, 64), "L")),
+        ]:
+            path = str(directory / f"{seed}.{name}")
+            image.save(path)
+            paths.append(path)
+        rng = numpy.random.default_rng(seed)
+        deep = (rng.random((120, 160)) * 65535).astype("uint16")
+        path = str(directory / f"{seed}.16bit.png")
+        PIL.Image.frombytes("I;16", (160, 120), deep.tobytes()).save(path)
+        paths.append(path)
+    return paths
+
+
+@pytest.mark.parametrize("hash_size", [8, 6])
+@pytest.mark.parametrize("method, reference", HASHES)
+def test_hashes_match_imagehash(image_paths, hash_size, method, reference):
+    import PIL.Image
+
+    hashes = getattr(PhashHelper(hash_size=hash_size), method)(image_paths)
+    assert set(hashes) == set(image_paths)
+    for path in image_paths:
+        with PIL.Image.open(path) as image:
+            assert hashes[path] == str(reference(image, hash_size=hash_size)), path
+
+
+def test_undecodable_images_are_left_out(image_paths, tmp_path):
+    broken = tmp_path / "broken.jpg"
+    broken.write_bytes(b"not an image")
+    missing = str(tmp_path / "missing.jpg")
+    hashes = PhashHelper().phash_paths([image_paths[0], str(broken), missing])
+    assert list(hashes) == [image_paths[0]]
+
+
+@pytest.mark.parametrize("method", [method for method, _ in HASHES])
+def test_batch_without_decodable_images(tmp_path, method):
+    broken = tmp_path / "broken.jpg"
+    broken.write_bytes(b"not an image")
+    assert getattr(PhashHelper(), method)([]) == {}
+    assert getattr(PhashHelper(), method)([str(broken)]) == {}
@@ -0,0 +1,70 @@
+"""
+Checks how the sandboxed workers report the failures of tasks and of the workers themselves
+"""
+import os
+import time
+
+from helpers.sandbox_helper import SandboxExecutor, SandboxFailure
+
+
+def square(value: int) -> int:
+    if value < 0:
+        raise ValueError("negative")
+    if value == 13:
+        os._exit(3)
+    if value == 99:
+        time.sleep(60)
+    if value == 7:
+        import module_that_does_not_exist  # noqa: F401
+    return value * value
+
+
+def failing_initializer() -> None:
+    raise OSError("no display")
+
+
+def exiting_initializer() -> None:
+    os._exit(1)
+
+
+def test_results_are_returned_in_order():
+    executor = SandboxExecutor(workers=2)
+    try:
+        assert executor.map(square, range(7)) == [value * value for value in range(7)]
+    finally:
+        executor.shutdown()
+
+
+def test_failing_tasks_dont_stop_the_others():
+    executor = SandboxExecutor(workers=2, timeout=5)
+    try:
+        results = executor.map(square, [2, -1, 13, 99, 3, 7])
+    finally:
+        executor.shutdown()
+    assert results[0] == 4 and results[4] == 9
+    failures = [results[index] for index in (1, 2, 3, 5)]
+    assert all(isinstance(failure, SandboxFailure) for failure in failures)
+    assert "raised ValueError" in str(failures[0]) and not failures[0].fatal
+    assert "crashed its worker" in str(failures[1]) and not failures[1].fatal
+    assert "timed out" in str(failures[2]) and not failures[2].fatal
+    # A missing library would fail every file the same way
+    assert failures[3].fatal
+
+
+def test_startup_doesnt_count_against_the_timeout():
+    executor = SandboxExecutor(workers=1, timeout=0.5, initializer=time.sleep, initargs=(1,))
+    try:
+        assert executor.map(square, [2, 3]) == [4, 9]
+    finally:
+        executor.shutdown()
+
+
+def test_workers_that_cant_start_are_fatal():
+    for initializer in (failing_initializer, exiting_initializer):
+        executor = SandboxExecutor(workers=2, timeout=5, initializer=initializer)
+        try:
+            results = executor.map(square, range(6))
+        finally:
+            executor.shutdown()
+        assert all(isinstance(result, SandboxFailure) and result.fatal for result in results)
+        assert "couldn't start its worker" in str(results[0])
@@ -0,0 +1,61 @@
+"""
+Checks that tokenizing a document chunk by chunk gives the tokens of the whole text
+"""
+import re
+
+import pytest
+
+import classes.file
+from classes.file import Text
+from helpers.text_reader_helper import TextReaderHelper
+
+WORDS = frozenset({"the", "quick", "brown", "fox", "jumps", "over", "lazy", "dog", "a"})
+
+TEXTS = [
+    "The quick brown fox jumps over the lazy dog.",
+    "the  quick\nbrown\tfox, jumps-over the_lazy dog2 a dog",
+    "Über the quick brown fox — jumps over a lazy dog!!",
+    "the " + "x" * 200 + " quick brown " + "fox" * 40 + " dog the",
+    "thequick brown fox123 jumps over lazy dog the",
+    "",
+]
+
+
+def get_tokens(text: str) -> list[str]:
+    """
+    Tokenizes the whole text at once: every pair of consecutive dictionary words
+    """
+    words = [token for token in re.findall(r"\b[a-z]+\b", text.lower()) if token in WORDS]
+    return ["".join(pair) for pair in zip(words, words[1:])]
+
+
+def split(text: str, size: int) -> list[str]:
+    return [text[start:start + size] for start in range(0, len(text), size)]
+
+
+@pytest.fixture(autouse=True)
+def word_set(monkeypatch):
+    monkeypatch.setattr(classes.file, "get_word_set", lambda: WORDS)
+
+
+@pytest.mark.parametrize("text", TEXTS)
+@pytest.mark.parametrize("size", [1, 2, 3, 5, 7, 64, 65, 1000])
+def test_chunked_tokens_match_whole_text(text, size):
+    text_file = Text.__new__(Text)
+    assert list(text_file._iter_partially_ordered_tokens(split(text, size))) == get_tokens(text)
+
+
+def test_empty_chunks_are_skipped():
+    text_file = Text.__new__(Text)
+    chunks = ["the qu", "", "ick", "", " brown fo", "x"]
+    expected = get_tokens("".join(chunks))
+    assert list(text_file._iter_partially_ordered_tokens(chunks)) == expected
+
+
+@pytest.mark.parametrize("max_chars", [None, 0, 1, 10, 44, 1000])
+def test_iter_file_stops_at_max_chars(tmp_path, max_chars):
+    path = tmp_path / "document.txt"
+    content = "The quick brown fox jumps over the lazy dog. " * 4
+    path.write_text(content, encoding="utf-8")
+    text = "".join(TextReaderHelper(max_chars=max_chars).iter_file(str(path), "txt"))
+    assert text == (content if max_chars is None else content[:max_chars])